@@ -0,0 +1,69 @@
+"""Rows per second of BookService.create_book (one INSERT + commit per book)
+against BookService.create_books_bulk (multi-row INSERT ... RETURNING).
+
+Runs against the database in DATABASE_URL and deletes the rows it created.
+
+    python -m benchmarks.bench_bulk_insert --rows 5000
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import delete
+from src.books.schemas import BookCreateModel
+from src.books.service import BookService
+from src.db.main import async_session_maker, async_engine
+from src.db.models import Book
+
+book_service = BookService()
+
+
+def make_books(count: int) -> list[dict]:
+    return [
+        {
+            "title": f"Benchmark book {i}",
+            "author": "Benchmark Author",
+            "publisher": "Benchmark Press",
+            "published_date": "2024-12-10",
+            "page_count": 100 + i % 500,
+            "language": "English",
+        }
+        for i in range(count)
+    ]
+
+
+async def bench_single(books: list[dict]) -> list:
+    uids = []
+    async with async_session_maker() as session:
+        for book in books:
+            new_book = await book_service.create_book(BookCreateModel(**book), None, session)
+            uids.append(new_book.uid)
+    return uids
+
+
+async def bench_bulk(books: list[dict]) -> list:
+    async with async_session_maker() as session:
+        result = await book_service.create_books_bulk(books, None, session)
+    return result["uids"]
+
+
+async def cleanup(uids: list) -> None:
+    async with async_session_maker() as session:
+        await session.execute(delete(Book).where(Book.uid.in_(uids)))
+        await session.commit()
+
+
+async def main(rows: int) -> None:
+    books = make_books(rows)
+    for name, bench in (("single insert", bench_single), ("bulk insert", bench_bulk)):
+        start = time.perf_counter()
+        uids = await bench(books)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>14}: {len(uids)} rows in {elapsed:.2f}s -> {len(uids) / elapsed:,.0f} rows/s")
+        await cleanup(uids)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    asyncio.run(main(parser.parse_args().rows))
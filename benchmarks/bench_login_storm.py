@@ -0,0 +1,53 @@
+"""Event loop latency during a login storm, with bcrypt on the event loop and on the password pool.
+
+A probe task stands in for the unrelated routes: it sleeps PROBE_INTERVAL over and over and records
+how late it wakes up. Meanwhile --logins password checks run concurrently, either calling bcrypt
+directly (what the handlers used to do) or through verify_password. No database or redis needed.
+
+    python -m benchmarks.bench_login_storm --logins 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from src.auth.utils import generate_password_hash, verify_password, password_context
+
+PROBE_INTERVAL = 0.005
+
+
+async def probe(delays: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        delays.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def blocking_login(password: str, hash: str) -> bool:
+    return password_context.verify(password, hash)
+
+
+async def storm(login, logins: int, hash: str) -> list[float]:
+    delays = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(delays, stop))
+    await asyncio.sleep(PROBE_INTERVAL * 2)
+    await asyncio.gather(*[login("benchmark", hash) for _ in range(logins)])
+    stop.set()
+    await probe_task
+    return delays
+
+
+async def main(logins: int) -> None:
+    hash = await generate_password_hash("benchmark")
+    for name, login in (("on event loop", blocking_login), ("password pool", verify_password)):
+        start = time.perf_counter()
+        delays = await storm(login, logins, hash)
+        elapsed = time.perf_counter() - start
+        p99 = statistics.quantiles(delays, n=100, method="inclusive")[-1] if len(delays) > 1 else delays[0]
+        print(f"{name:>14}: {logins} logins in {elapsed:.2f}s, event loop lag p50 {statistics.median(delays):.1f}ms p99 {p99:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    asyncio.run(main(parser.parse_args().logins))
@@ -0,0 +1,92 @@
+"""Latency of ReviewService.add_review_to_book for a book and a user that already
+have 0, 1k and 10k reviews. The write path does not load either collection, so the
+numbers should stay flat as the collections grow.
+
+Runs against the database in DATABASE_URL and deletes the rows it created.
+
+    python -m benchmarks.bench_review_write --writes 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import date
+from sqlalchemy import delete, insert
+from src.db.main import async_session_maker, async_engine
+from src.db.models import Book, Review, User
+from src.reviews.schemas import ReviewCreateModel
+from src.reviews.service import ReviewService
+
+review_service = ReviewService()
+
+COLLECTION_SIZES = (0, 1_000, 10_000)
+
+
+async def create_fixture(existing_reviews: int) -> tuple[uuid.UUID, uuid.UUID]:
+    user_uid, book_uid = uuid.uuid4(), uuid.uuid4()
+    async with async_session_maker() as session:
+        await session.execute(insert(User).values(
+            uid=user_uid,
+            username=f"bench-{user_uid.hex[:8]}",
+            email=f"bench-{user_uid.hex}@example.com",
+            first_name="Bench",
+            last_name="Mark",
+            password_hash="x",
+            is_verified=True,
+        ))
+        await session.execute(insert(Book).values(
+            uid=book_uid,
+            title="Benchmark book",
+            author="Benchmark Author",
+            publisher="Benchmark Press",
+            published_date=date(2024, 12, 10),
+            page_count=100,
+            language="English",
+            user_uid=user_uid,
+        ))
+        for start in range(0, existing_reviews, 1000):
+            rows = [
+                {"rating": 1 + i % 5, "review_text": "seed", "user_uid": user_uid, "book_uid": book_uid}
+                for i in range(start, min(start + 1000, existing_reviews))
+            ]
+            await session.execute(insert(Review).values(rows))
+        await session.commit()
+    return user_uid, book_uid
+
+
+async def cleanup(user_uid: uuid.UUID, book_uid: uuid.UUID) -> None:
+    async with async_session_maker() as session:
+        await session.execute(delete(Review).where(Review.book_uid == book_uid))
+        await session.execute(delete(Book).where(Book.uid == book_uid))
+        await session.execute(delete(User).where(User.uid == user_uid))
+        await session.commit()
+
+
+async def bench(existing_reviews: int, writes: int) -> list[float]:
+    user_uid, book_uid = await create_fixture(existing_reviews)
+    review_data = ReviewCreateModel(rating=4, review_text="benchmark review")
+    timings = []
+    try:
+        for _ in range(writes):
+            async with async_session_maker() as session:
+                start = time.perf_counter()
+                await review_service.add_review_to_book(user_uid, review_data, book_uid, session)
+                timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        await cleanup(user_uid, book_uid)
+    return timings
+
+
+async def main(writes: int) -> None:
+    for existing_reviews in COLLECTION_SIZES:
+        timings = await bench(existing_reviews, writes)
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{existing_reviews:>6} existing reviews: median {statistics.median(timings):.2f}ms, p95 {p95:.2f}ms")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=200)
+    asyncio.run(main(parser.parse_args().writes))
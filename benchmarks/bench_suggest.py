@@ -0,0 +1,86 @@
+"""Cold cache latency of BookService.suggest_books for 1, 2, 3 and 5 character prefixes
+over a seeded catalog. One and two characters take the btree range path, longer prefixes
+the trigram path, both should stay in single digit milliseconds at the p99.
+
+Runs against the database in DATABASE_URL and deletes the rows it created.
+
+    python -m benchmarks.bench_suggest --books 100000 --queries 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date
+from sqlalchemy import delete, insert, text
+from src.books import service as book_service_module
+from src.books.service import BookService
+from src.db.main import async_session_maker, async_engine
+from src.db.models import Book
+
+book_service = BookService()
+
+WORDS = ("the", "a", "of", "night", "shadow", "river", "king", "silent", "garden", "winter", "lost", "city",
+         "hobbit", "empire", "stone", "dream", "house", "war", "light", "song", "sea", "iron", "tolkien", "dune")
+PREFIXES = ("a", "th", "the", "shado")
+
+
+def make_books(count: int) -> list[dict]:
+    rng = random.Random(42)
+    return [
+        {
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))).capitalize() + f" {i}",
+            "author": f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()}",
+            "publisher": "Benchmark Press",
+            "published_date": date(2024, 12, 10),
+            "page_count": 100 + i % 500,
+            "language": "English",
+        }
+        for i in range(count)
+    ]
+
+
+async def seed(count: int) -> None:
+    books = make_books(count)
+    async with async_session_maker() as session:
+        for start in range(0, count, 5000):
+            await session.execute(insert(Book).values(books[start:start + 5000]))
+        await session.commit()
+        await session.execute(text("ANALYZE books"))
+
+
+async def cleanup() -> None:
+    async with async_session_maker() as session:
+        await session.execute(delete(Book).where(Book.publisher == "Benchmark Press"))
+        await session.commit()
+
+
+async def bench(prefix: str, queries: int) -> list[float]:
+    timings = []
+    async with async_session_maker() as session:
+        for _ in range(queries):
+            book_service_module.suggest_cache.clear()
+            start = time.perf_counter()
+            await book_service.suggest_books(prefix, session)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def main(books: int, queries: int) -> None:
+    await seed(books)
+    try:
+        for prefix in PREFIXES:
+            timings = await bench(prefix, queries)
+            p99 = statistics.quantiles(timings, n=100)[-1]
+            print(f"prefix {prefix!r:>8}: median {statistics.median(timings):.2f}ms, p99 {p99:.2f}ms")
+    finally:
+        await cleanup()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.books, args.queries))
@@ -29,6 +29,19 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = SQLModel.metadata
 
+# created by migrations on purpose but not mapped on the models, autogenerate must not drop them
+# (books.search_vector is a generated tsvector only read by BookService.search_books, see src/books/service.py)
+UNMAPPED_SCHEMA_OBJECTS = {
+    ("column", "books", "search_vector"),
+    ("index", "books", "ix_books_search_vector"),
+}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and compare_to is None and type_ in ("column", "index"):
+        return (type_, object.table.name, name) not in UNMAPPED_SCHEMA_OBJECTS
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -51,6 +64,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -60,7 +74,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
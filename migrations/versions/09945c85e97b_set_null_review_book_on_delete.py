@@ -0,0 +1,31 @@
+"""set null review book on delete
+
+Revision ID: 09945c85e97b
+Revises: 2fc333ae5113
+Create Date: 2026-10-18 12:16:39.270514
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '09945c85e97b'
+down_revision: Union[str, None] = '2fc333ae5113'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # BookService.delete_book is a single DELETE ... RETURNING now, postgres detaches the reviews
+    # the same way the ORM used to before deleting the book.
+    op.drop_constraint('reviews_book_uid_fkey', 'reviews', type_='foreignkey')
+    op.create_foreign_key('reviews_book_uid_fkey', 'reviews', 'books', ['book_uid'], ['uid'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    op.drop_constraint('reviews_book_uid_fkey', 'reviews', type_='foreignkey')
+    op.create_foreign_key('reviews_book_uid_fkey', 'reviews', 'books', ['book_uid'], ['uid'])
@@ -0,0 +1,33 @@
+"""add books trigram indexes
+
+Revision ID: 0b2145935d53
+Revises: 811c5c7db0eb
+Create Date: 2026-10-18 10:41:55.103672
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b2145935d53'
+down_revision: Union[str, None] = '811c5c7db0eb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_books_title_trgm', 'books', ['title'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('ix_books_author_trgm', 'books', ['author'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_author_trgm', table_name='books', postgresql_using='gin')
+    op.drop_index('ix_books_title_trgm', table_name='books', postgresql_using='gin')
+    # the pg_trgm extension is left installed, other objects may depend on it
@@ -0,0 +1,41 @@
+"""add books search vector
+
+Revision ID: 811c5c7db0eb
+Revises: 0b322d5c5793
+Create Date: 2026-10-18 10:03:17.884210
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '811c5c7db0eb'
+down_revision: Union[str, None] = '0b322d5c5793'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # search_vector is generated and stored by postgres, it is not mapped on the Book model.
+    # title matches rank above author matches, which rank above publisher matches.
+    op.add_column('books', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(author, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(publisher, '')), 'C')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index('ix_books_search_vector', 'books', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_search_vector', table_name='books', postgresql_using='gin')
+    op.drop_column('books', 'search_vector')
@@ -0,0 +1,29 @@
+"""add users lower(email) unique index
+
+Revision ID: f4398e5705a5
+Revises: 803923d52026
+Create Date: 2026-10-18 17:05:52.661390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4398e5705a5'
+down_revision: Union[str, None] = '803923d52026'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # fails if two accounts already share an email in different case, merge or rename those first:
+    # SELECT lower(email), count(*) FROM users GROUP BY 1 HAVING count(*) > 1
+    op.create_index('ux_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_users_email_lower', table_name='users')
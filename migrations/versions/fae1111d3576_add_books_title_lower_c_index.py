@@ -0,0 +1,28 @@
+"""add books lower(title) C collation index
+
+Revision ID: fae1111d3576
+Revises: f4398e5705a5
+Create Date: 2026-10-18 18:02:41.237905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fae1111d3576'
+down_revision: Union[str, None] = 'f4398e5705a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # serves /books/suggest for prefixes too short for the trigram indexes
+    op.create_index('ix_books_title_lower_c', 'books', [sa.text('lower(title) COLLATE "C"')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_title_lower_c', table_name='books')
@@ -1,9 +1,15 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from src.books.routes import book_router
 from contextlib import asynccontextmanager
 from src.db.main import init_db
 from src.auth.routes import auth_router
 from src.reviews.routes import review_router
+from src.reviews.ingest import ReviewIngestConsumer
+from src.config import Config
+from src.db.redis import listen_for_revocations
 from .errors import register_all_errors
 from .middleware import register_middleware
 
@@ -18,13 +24,26 @@ async def life_span(app : FastAPI):
     print("Server is ending...") """
 
 
+@asynccontextmanager
+async def lifespan(app : FastAPI):
+    #background consumers run next to the api in every worker process
+    tasks = [asyncio.create_task(listen_for_revocations())]
+    if Config.REVIEW_WRITE_BEHIND:
+        tasks.append(asyncio.create_task(ReviewIngestConsumer().run()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 version = "v1"
 
 app = FastAPI(
     title="Bookly",
     description="A REST API for a book review web service",
-    version=version
+    version=version,
     #lifespan=life_span ,no more needed
+    lifespan=lifespan,
 )
 
 register_all_errors(app)
@@ -35,4 +54,10 @@ app.include_router(auth_router ,prefix=f"/api/{version}/auth", tags=['auth'])
 app.include_router(review_router ,prefix=f"/api/{version}/reviews", tags=['review'])
 
 
+#prometheus scrape endpoint, e.g. the book detail cache hit/miss counters
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 
@@ -0,0 +1,52 @@
+import argparse
+import statistics
+import time
+from passlib.hash import bcrypt
+
+#Picks BCRYPT_ROUNDS for this host: every extra round doubles the cost of a hash (and of a login),
+#the recommendation is the highest cost whose median hash time stays within the target.
+#
+#    python -m src.auth.bcrypt_calibration --target-ms 250
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+def time_rounds(rounds : int, samples : int) -> float:
+    """Median milliseconds of one bcrypt hash with the given cost."""
+    hasher = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms : float, samples : int = 5) -> tuple[int, dict[int, float]]:
+    timings = {}
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        timings[rounds] = time_rounds(rounds, samples)
+        #the next cost takes about twice as long, no need to measure it
+        if timings[rounds] > target_ms:
+            break
+    within_target = [rounds for rounds, elapsed in timings.items() if elapsed <= target_ms]
+    return (max(within_target) if within_target else MIN_ROUNDS), timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recommend a bcrypt cost (BCRYPT_ROUNDS) for this host")
+    parser.add_argument("--target-ms", type=float, default=250, help="acceptable time for one hash or login check")
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    recommended, timings = calibrate(args.target_ms, args.samples)
+    for rounds, elapsed in timings.items():
+        print(f"rounds {rounds:>2}: {elapsed:8.1f}ms")
+    print(f"BCRYPT_ROUNDS={recommended}")
+    if timings[recommended] > args.target_ms:
+        print(f"even {MIN_ROUNDS} rounds take longer than {args.target_ms}ms on this host, consider more PASSWORD_HASH_WORKERS instead")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import logging
+from redis.exceptions import RedisError
+from src.cache import TTLCache
+from src.config import Config
+from src.db.redis import redis_client
+from sqlmodel import select
+from src.db.main import async_session_maker
+from src.db.models import User
+from .schemas import Principal
+
+#Authenticated principals (uid, email, role, is_verified), two levels:
+#a small in-process cache answers most requests without any i/o, redis shares the entries between workers.
+#UserService invalidates both on every change of role, is_verified or password. Another worker's in-process
+#copy is not reached by that, which is why PRINCIPAL_LOCAL_TTL is only a few seconds.
+PRINCIPAL_CACHE_VERSION = 1
+
+local_principals = TTLCache(maxsize=10_000, ttl=Config.PRINCIPAL_LOCAL_TTL)
+
+
+def principal_key(user_uid) -> str:
+    return f"principal:v{PRINCIPAL_CACHE_VERSION}:{user_uid}"
+
+
+async def get_cached_principal(user_uid) -> Principal | None:
+    principal = local_principals.get(str(user_uid))
+    if principal is not None:
+        return principal
+    try:
+        payload = await redis_client.get(principal_key(user_uid))
+    except RedisError as e:
+        logging.warning(f"principal cache read failed: {e}")
+        return None
+    if payload is None:
+        return None
+    principal = Principal.model_validate_json(payload)
+    local_principals.set(str(user_uid), principal)
+    return principal
+
+
+async def cache_principal(principal : Principal) -> None:
+    local_principals.set(str(principal.uid), principal)
+    try:
+        await redis_client.set(principal_key(principal.uid), principal.model_dump_json(), ex=Config.PRINCIPAL_CACHE_TTL)
+    except RedisError as e:
+        logging.warning(f"principal cache write failed: {e}")
+
+
+async def invalidate_principal(user_uid) -> None:
+    local_principals.pop(str(user_uid))
+    try:
+        await redis_client.delete(principal_key(user_uid))
+    except RedisError as e:
+        logging.warning(f"principal cache invalidation failed: {e}")
+
+
+#Token generations, the "gen" claim of a token has to match the user's current one (TokenBearer).
+#They live in the redis hash token_generations (user uid -> generation) and for TOKEN_GENERATION_LOCAL_TTL
+#seconds in every worker, postgres (users.token_generation) is only asked when redis lost the hash.
+TOKEN_GENERATIONS_KEY = "token_generations"
+TOKEN_GENERATION_LOCAL_TTL = 5
+
+local_token_generations = TTLCache(maxsize=10_000, ttl=TOKEN_GENERATION_LOCAL_TTL)
+
+
+async def get_token_generation(user_uid) -> int | None:
+    """The current generation of a user, None if the user does not exist."""
+    generation = local_token_generations.get(str(user_uid))
+    if generation is not None:
+        return generation
+    try:
+        generation = await redis_client.hget(TOKEN_GENERATIONS_KEY, str(user_uid))
+    except RedisError as e:
+        logging.warning(f"token generation read failed: {e}")
+        generation = None
+    if generation is not None:
+        generation = int(generation)
+    else:
+        async with async_session_maker() as session:
+            result = await session.exec(select(User.token_generation).where(User.uid == user_uid))
+            generation = result.first()
+        if generation is None:
+            return None
+        await cache_token_generation(user_uid, generation, overwrite=False)
+    local_token_generations.set(str(user_uid), generation)
+    return generation
+
+
+async def cache_token_generation(user_uid, generation : int, overwrite : bool = True) -> None:
+    """overwrite=True publishes a new generation (revoke_all_tokens), overwrite=False only fills a missing entry.
+
+    A new generation that can not be written must not leave the old one behind in redis, every worker would keep
+    accepting the revoked tokens. The entry is dropped instead so reads fall back to postgres, and if even that
+    fails the error is raised to the caller.
+    """
+    local_token_generations.set(str(user_uid), generation)
+    if not overwrite:
+        #a value read from postgres never overwrites one written by revoke_all_tokens, it may be older
+        try:
+            await redis_client.hsetnx(TOKEN_GENERATIONS_KEY, str(user_uid), generation)
+        except RedisError as e:
+            logging.warning(f"token generation write failed: {e}")
+        return
+    try:
+        await redis_client.hset(TOKEN_GENERATIONS_KEY, str(user_uid), generation)
+    except RedisError as e:
+        logging.warning(f"token generation write failed, dropping the cached one: {e}")
+        await redis_client.hdel(TOKEN_GENERATIONS_KEY, str(user_uid))
@@ -1,32 +1,31 @@
 from fastapi import APIRouter , status , Depends, BackgroundTasks
 
 from ..mail import create_message, mail
-from .schemas import UserCreateModel, UserModel, UserLoginModel, UserBooksModel, EmailModel, PasswordResetRequestModel, PasswordResetConfirmModel
+from .schemas import UserCreateModel, UserModel, UserLoginModel, UserBooksModel, EmailModel, PasswordResetRequestModel, PasswordResetConfirmModel, UserRoleModel
 from .service import UserService
 from sqlmodel.ext.asyncio.session import AsyncSession
 from src.db.main import get_session
 from typing import Annotated
 from fastapi.exceptions import  HTTPException
-from .utils import create_access_token, decode_token, verify_password, create_url_safe_token, decode_url_safe_token, generate_password_hash
+from .utils import create_access_token, decode_token, verify_password, create_url_safe_token, decode_url_safe_token, generate_password_hash, password_needs_rehash
 from fastapi.responses import JSONResponse
 from datetime import timedelta, datetime
-from .dependencies import RefreshTokenBearer, AccessTokenBearer, get_current_user, RoleChecker
+from .dependencies import RefreshTokenBearer, AccessTokenDetails, get_current_user, RoleChecker
 from src.db.redis import add_jti_to_blocklist
 from src.errors import UserAlreadyExists, UserNotFound, InvalidCredentials, InvalidToken
 from ..config import Config
 from src.db.models import User
 from ..celery_tasks import send_email
+from ..ratelimit import RateLimiter, submitted_email
 
 
 user_service = UserService()
 auth_router = APIRouter()
 refresh_token_bearer = RefreshTokenBearer()
-access_token_bearer = AccessTokenBearer()
 
 
 MyAsyncSession = Annotated[AsyncSession, Depends(get_session)]
 RefreshTokenDetails = Annotated[dict,Depends(refresh_token_bearer)]
-AccessTokenDetails = Annotated[dict,Depends(access_token_bearer)]
 
 # Instance creation - __init__ runs immediately
 AdminOnly = Annotated[bool, Depends(RoleChecker(["admin"]))]
@@ -35,9 +34,14 @@ UserAndAdmin = Annotated[bool, Depends(RoleChecker(["admin", "user"]))]
 
 REFRESH_TOKEN_EXPIRY=7
 
+#request and confirm share the same buckets (per client ip, and per email for requests)
+password_reset_rate_limit = Depends(
+    RateLimiter(Config.RATE_LIMIT_PASSWORD_RESET, key=submitted_email, scope="password-reset")
+)
 
 
-@auth_router.post("/send_mail")
+
+@auth_router.post("/send_mail", dependencies=[Depends(RateLimiter(Config.RATE_LIMIT_SEND_MAIL))])
 async def send_mail(emails: EmailModel):
     emails = emails.addresses
 
@@ -50,18 +54,18 @@ async def send_mail(emails: EmailModel):
 
     return {"message": "Email sent successfully"}
 
-@auth_router.post('/signup', status_code=status.HTTP_201_CREATED)
+@auth_router.post('/signup', status_code=status.HTTP_201_CREATED, dependencies=[Depends(RateLimiter(Config.RATE_LIMIT_SIGNUP))])
 async def create_user_account(user_data : UserCreateModel , bg_tasks : BackgroundTasks, session : MyAsyncSession ):
     email = user_data.email
-    is_exist = await user_service.user_exists_by_email(email , session)
-    if is_exist:
+    #existence check, then INSERT ... ON CONFLICT DO NOTHING for races, a taken email comes back as None
+    new_user = await user_service.create_user(user_data, session)
+    if new_user is None:
         # This:
         raise UserAlreadyExists()
         # Gets caught by FastAPI, which then:
         # 1. Sees it's a UserAlreadyExists exception
         # 2. Looks up the registered handler
         # 3. Returns the pre-defined response:
-    new_user = await user_service.create_user(user_data, session)
 
     token = create_url_safe_token({"email": email})
     link = f"http://{Config.DOMAIN}/api/v1/auth/verify/{token}"
@@ -91,10 +95,7 @@ async def get_token(token : str, session : MyAsyncSession):
         user = await user_service.get_user_by_email(mail , session)
         if not user:
             raise UserNotFound()
-        user.sqlmodel_update({'is_verified' : True})
-        session.add(user)
-        await session.commit()
-        session.refresh(user)
+        await user_service.update_user(user, {'is_verified' : True}, session)
         return JSONResponse(
             content={"message": "Account verified successfully"},
             status_code=status.HTTP_200_OK,
@@ -104,23 +105,28 @@ async def get_token(token : str, session : MyAsyncSession):
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
 
-@auth_router.post('/login')
+@auth_router.post('/login', dependencies=[Depends(RateLimiter(Config.RATE_LIMIT_LOGIN, key=submitted_email))])
 async def login_users(login_data: UserLoginModel, session : MyAsyncSession):
     email = login_data.email
     password = login_data.password
-    is_exist = await user_service.user_exists_by_email(email, session)
-    if is_exist:
-        user = await user_service.get_user_by_email(email,session)
+    #uid, email, role, password_hash and token_generation in a single query, no User entity and no relationships
+    user = await user_service.get_login_credentials(email, session)
+    if user:
         hashed_password_in_database = user.password_hash
-        is_password_true = verify_password(password, hashed_password_in_database )
+        is_password_true = await verify_password(password, hashed_password_in_database )
         if is_password_true:
+            #the hash was made with another bcrypt cost than BCRYPT_ROUNDS, the plain password is only known right now
+            if password_needs_rehash(hashed_password_in_database):
+                await user_service.rehash_password(user.uid, password, session)
             access_token = create_access_token(
-                user_data= {'email' : user.email, 'user_uid' : str(user.uid), "role" : user.role}
+                user_data= {'email' : user.email, 'user_uid' : str(user.uid), "role" : user.role},
+                generation=user.token_generation
             )
             refresh_token = create_access_token(
                 user_data= {'email' : user.email, 'user_uid' : str(user.uid)},
                 refresh=True,
-                expiry=timedelta(days=REFRESH_TOKEN_EXPIRY)
+                expiry=timedelta(days=REFRESH_TOKEN_EXPIRY),
+                generation=user.token_generation
             )
             return JSONResponse(
                 content={
@@ -140,7 +146,7 @@ async def login_users(login_data: UserLoginModel, session : MyAsyncSession):
 async def get_new_access_token(token_details : RefreshTokenDetails):
     expiry_timestamp = token_details["exp"]
     if datetime.fromtimestamp(expiry_timestamp) > datetime.now():
-        new_access_token = create_access_token(user_data=token_details["user"])
+        new_access_token = create_access_token(user_data=token_details["user"], generation=token_details.get("gen", 0))
         return JSONResponse(content={"access_token": new_access_token})
     raise InvalidToken()
 
@@ -156,6 +162,27 @@ async def get_current_user(authorized : UserAndAdmin ,user = Depends(get_current
     return user
 
 
+@auth_router.patch("/users/{user_uid}/role")
+async def change_user_role(user_uid : str, role_data : UserRoleModel, authorized : AdminOnly, session : MyAsyncSession):
+    if not await user_service.update_role(user_uid, role_data.role, session):
+        raise UserNotFound()
+    return JSONResponse(content={"message": "Role updated successfully"}, status_code=status.HTTP_200_OK)
+
+
+#"log out everywhere": every access and refresh token issued so far stops working
+@auth_router.post("/sessions/revoke")
+async def revoke_my_sessions(token_details : AccessTokenDetails, session : MyAsyncSession):
+    await user_service.revoke_all_tokens(token_details["user"]["user_uid"], session)
+    return JSONResponse(content={"message": "All sessions revoked"}, status_code=status.HTTP_200_OK)
+
+
+@auth_router.post("/users/{user_uid}/sessions/revoke")
+async def revoke_user_sessions(user_uid : str, authorized : AdminOnly, session : MyAsyncSession):
+    if not await user_service.revoke_all_tokens(user_uid, session):
+        raise UserNotFound()
+    return JSONResponse(content={"message": "All sessions revoked"}, status_code=status.HTTP_200_OK)
+
+
 @auth_router.get("/logout")
 async def revooke_token(token_details : AccessTokenDetails):
     jti = token_details["jti"]
@@ -168,7 +195,7 @@ async def revooke_token(token_details : AccessTokenDetails):
 
 
 
-@auth_router.post("/password-reset-request")
+@auth_router.post("/password-reset-request", dependencies=[password_reset_rate_limit])
 async def password_reset_request(email_data: PasswordResetRequestModel):
     email = email_data.email
 
@@ -196,7 +223,7 @@ async def password_reset_request(email_data: PasswordResetRequestModel):
 
 
 
-@auth_router.post("/password-reset-confirm/{token}")
+@auth_router.post("/password-reset-confirm/{token}", dependencies=[password_reset_rate_limit])
 async def reset_account_password(
     token: str,
     passwords: PasswordResetConfirmModel,
@@ -219,12 +246,9 @@ async def reset_account_password(
         if not user:
             raise UserNotFound()
         
-        passwd_hash = generate_password_hash(new_password)
+        passwd_hash = await generate_password_hash(new_password)
 
-        user.sqlmodel_update({"password_hash": passwd_hash})
-        session.add(user)
-        await session.commit()
-        session.refresh(user)
+        await user_service.update_user(user, {"password_hash": passwd_hash}, session)
 
         return JSONResponse(
             content={"message": "Password reset Successfully"},
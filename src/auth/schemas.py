@@ -1,7 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 import uuid
-from typing import List
+from typing import List, Literal
 from src.books.schemas import Book
 from src.reviews.schemas import ReviewModel
 
@@ -25,6 +25,16 @@ class UserModel(BaseModel):
     update_at: datetime
 
 
+class Principal(BaseModel):
+    """The authenticated user as authorization sees it, cached per user (src/auth/cache.py)."""
+    model_config = ConfigDict(frozen=True)
+
+    uid : uuid.UUID
+    email : str
+    role : str
+    is_verified : bool
+
+
 class UserBooksModel(UserModel):
     books: List[Book]
     reviews: List[ReviewModel]
@@ -41,4 +51,7 @@ class PasswordResetRequestModel(BaseModel):
     
 class PasswordResetConfirmModel(BaseModel):
     new_password: str
-    confirm_new_password: str
\ No newline at end of file
+    confirm_new_password: str
+
+class UserRoleModel(BaseModel):
+    role : Literal["user", "admin"]
@@ -1,29 +1,114 @@
-from sqlmodel import select
+from sqlmodel import select, update, func
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel.ext.asyncio.session import AsyncSession
-from .schemas import UserCreateModel
+from .schemas import UserCreateModel, Principal
 from .utils import generate_password_hash
+from .cache import get_cached_principal, cache_principal, invalidate_principal, cache_token_generation
 from src.db.models import User
 
 
+#what signup sends back, never the password hash
+USER_PUBLIC_COLUMNS = ("uid", "username", "email", "first_name", "last_name", "role", "is_verified", "created_at", "update_at")
+
+
 class UserService:
 
     async def get_user_by_email(self, email : str, session : AsyncSession):
-        statement = select(User).where(User.email == email)
+        statement = select(User).where(func.lower(User.email) == email.lower())
         result = await session.exec(statement)
         user = result.first()
         return user
     
     async def user_exists_by_email(self, email : str, session : AsyncSession):
-        user = await self.get_user_by_email(email, session)
-        return True if user else False
+        statement = select(User.uid).where(func.lower(User.email) == email.lower())
+        result = await session.exec(statement)
+        return result.first() is not None
+
+    async def get_login_credentials(self, email : str, session : AsyncSession):
+        """Everything /login needs in one column-only query on the lower(email) index, None for an unknown email."""
+        statement = select(
+            User.uid, User.email, User.role, User.password_hash, User.token_generation
+        ).where(func.lower(User.email) == email.lower())
+        result = await session.exec(statement)
+        return result.first()
+
+    async def get_principal(self, user_uid : str, session : AsyncSession) -> Principal | None:
+        """uid, email, role and is_verified of a user, from the principal cache or from a four column select.
+        Never loads the User entity, whose books and reviews are selectin relationships."""
+        principal = await get_cached_principal(user_uid)
+        if principal is not None:
+            return principal
+        statement = select(User.uid, User.email, User.role, User.is_verified).where(User.uid == user_uid)
+        result = await session.exec(statement)
+        row = result.first()
+        if row is None:
+            return None
+        principal = Principal.model_validate(row._mapping)
+        await cache_principal(principal)
+        return principal
 
     async def create_user(self, user_data: UserCreateModel, session: AsyncSession):
+        """Insert the user with INSERT ... ON CONFLICT DO NOTHING RETURNING, None means the email is taken
+        (case-insensitively).
+
+        A taken email is turned away by a column-only lookup on the lower(email) index before the password is
+        hashed, so duplicate signups cost no bcrypt slot. ON CONFLICT only catches two signups racing for one email.
+        """
+        if await self.user_exists_by_email(user_data.email, session):
+            return None
         user_data_dict = user_data.model_dump()
-        new_user = User(**user_data_dict)
-        new_user.password_hash = generate_password_hash(user_data_dict['password'])
-        
-        new_user.role = "user"
+        password = user_data_dict.pop('password')
+        user_data_dict['password_hash'] = await generate_password_hash(password)
+        user_data_dict['role'] = "user"
+
+        statement = (
+            insert(User)
+            .values(**user_data_dict)
+            .on_conflict_do_nothing(index_elements=[func.lower(User.email)])
+            .returning(*[column for column in User.__table__.columns if column.key in USER_PUBLIC_COLUMNS])
+        )
+        result = await session.execute(statement)
+        new_user = result.mappings().first()
+        if new_user is None:
+            return None
+        await session.commit()
+        return dict(new_user)
+
+    #every change that matters for authorization goes through one of these, they drop the cached principal
+    async def update_user(self, user : User, user_data : dict, session : AsyncSession) -> User:
+        user.sqlmodel_update(user_data)
+        session.add(user)
+        await session.commit()
+        await invalidate_principal(user.uid)
+        return user
+
+    async def update_role(self, user_uid : str, role : str, session : AsyncSession) -> bool:
+        statement = update(User).where(User.uid == user_uid).values(role=role).returning(User.uid)
+        result = await session.execute(statement)
+        if result.first() is None:
+            return False
+        await session.commit()
+        await invalidate_principal(user_uid)
+        return True
+
+    async def revoke_all_tokens(self, user_uid : str, session : AsyncSession) -> bool:
+        """Invalidate every access and refresh token of the user with a single UPDATE, nothing is blocklisted."""
+        statement = (
+            update(User)
+            .where(User.uid == user_uid)
+            .values(token_generation=User.token_generation + 1)
+            .returning(User.token_generation)
+        )
+        result = await session.execute(statement)
+        generation = result.scalar_one_or_none()
+        if generation is None:
+            return False
+        await session.commit()
+        await cache_token_generation(user_uid, generation)
+        return True
 
-        session.add(new_user)
+    async def rehash_password(self, user_uid, password : str, session : AsyncSession) -> None:
+        """Store the password again with the configured bcrypt cost, called after a successful login."""
+        password_hash = await generate_password_hash(password)
+        await session.execute(update(User).where(User.uid == user_uid).values(password_hash=password_hash))
         await session.commit()
-        return new_user
\ No newline at end of file
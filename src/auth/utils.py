@@ -4,30 +4,70 @@ import jwt
 from src.config import Config
 import uuid
 import logging
+import hashlib
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import Counter, Gauge, Histogram
+from src.cache import TTLCache
 from itsdangerous import URLSafeTimedSerializer
 
+#BCRYPT_ROUNDS comes from `python -m src.auth.bcrypt_calibration`, hashes made with any other cost
+#are reported by needs_update and replaced on the next successful login
 password_context = CryptContext(
-    schemes=['bcrypt']
+    schemes=['bcrypt'],
+    bcrypt__rounds=Config.BCRYPT_ROUNDS
 )
 
 ACCESS_TOKEN_EXPIRY = 3600
 
+#sha256(token) -> verified payload, see decode_token
+verified_tokens = TTLCache(maxsize=Config.JWT_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRY)
+jwt_cache_hits = Counter("bookly_jwt_cache_hits_total", "JWTs whose signature check was skipped thanks to the verified token cache")
+jwt_cache_misses = Counter("bookly_jwt_cache_misses_total", "JWTs that were verified and decoded")
 
-def generate_password_hash(password: str) -> str:
-    hash = password_context.hash(password)
+
+#bcrypt is slow on purpose (a few hundred ms per call). It releases the GIL, so it runs on a small thread pool
+#instead of blocking the event loop, and PASSWORD_HASH_WORKERS caps how many hashes a worker runs at once,
+#a login storm then queues up here while every other request keeps being served.
+password_executor = ThreadPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_queue_depth = Gauge("bookly_password_hash_queue_depth", "Password hash/verify calls submitted and not finished yet")
+password_hash_in_progress = Gauge("bookly_password_hash_in_progress", "Password hash/verify calls running on the pool")
+password_hash_wait = Histogram("bookly_password_hash_wait_seconds", "Time password hash/verify calls waited for a pool thread")
+
+
+async def run_password_task(func, *args):
+    queued_at = time.perf_counter()
+
+    def task():
+        password_hash_wait.observe(time.perf_counter() - queued_at)
+        with password_hash_in_progress.track_inprogress():
+            return func(*args)
+
+    with password_hash_queue_depth.track_inprogress():
+        return await asyncio.get_running_loop().run_in_executor(password_executor, task)
+
+
+async def generate_password_hash(password: str) -> str:
+    hash = await run_password_task(password_context.hash, password)
     return hash
 
-def verify_password(password : str , hash : str) -> bool:
-    return password_context.verify(password, hash)
+async def verify_password(password : str , hash : str) -> bool:
+    return await run_password_task(password_context.verify, password, hash)
+
+def password_needs_rehash(hash : str) -> bool:
+    #only parses the hash, no bcrypt work
+    return password_context.needs_update(hash)
 
-def create_access_token(user_data: dict, expiry: timedelta = None, refresh : bool = False):
+def create_access_token(user_data: dict, expiry: timedelta = None, refresh : bool = False, generation : int = 0):
     #by giving them default value it makes them optional.
     payload = {}
     payload['user'] = user_data
+    #users.token_generation at the time of issue, see TokenBearer
+    payload['gen'] = generation
     payload['exp'] = datetime.now() + (expiry if expiry else timedelta(seconds=ACCESS_TOKEN_EXPIRY))
-    payload['jti'] = str(uuid.uuid4)
+    payload['jti'] = str(uuid.uuid4())
     payload['refresh'] = refresh
-    print(Config.JWT_ALGORITHM)
     token = jwt.encode(
         payload=payload,
         key=Config.JWT_SECRET,
@@ -43,17 +83,34 @@ def create_access_token(user_data: dict, expiry: timedelta = None, refresh : boo
     """
     return token
 
-def decode_token(token : str) -> dict:
+def decode_token(token : str, log_failures : bool = True) -> dict:
+    """Verify and decode a JWT, None if it is invalid or expired.
+
+    Verified tokens are cached by their sha256 until their exp, so a client that reuses its token pays for the
+    HMAC check and the json parsing once. The returned dict is shared with the cache, treat it as read-only.
+    log_failures=False is for callers that only peek at the token (the rate limiter), TokenBearer logs it.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    token_data = verified_tokens.get(key)
+    if token_data is not None:
+        jwt_cache_hits.inc()
+        return token_data
+    jwt_cache_misses.inc()
     try:
         token_data = jwt.decode(
             jwt=token,
             key=Config.JWT_SECRET,
             algorithms=[Config.JWT_ALGORITHM]
         )
-        return token_data
     except jwt.PyJWTError as e:
-        logging.exception(e)
+        if log_failures:
+            logging.exception(e)
         return None
+    #invalid tokens are never cached, a valid one is dropped when it expires
+    remaining = token_data["exp"] - time.time() if "exp" in token_data else ACCESS_TOKEN_EXPIRY
+    if remaining > 0:
+        verified_tokens.set(key, token_data, ttl=min(remaining, ACCESS_TOKEN_EXPIRY))
+    return token_data
 
 
 serializer = URLSafeTimedSerializer(
@@ -0,0 +1,66 @@
+import logging
+import uuid
+from datetime import datetime
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+from src.config import Config
+from src.db.redis import redis_client
+
+#Read-through cache of the serialized GET /books/{book_uid} payload.
+#Bump the version whenever the cached payload changes shape, old entries are then never read again
+#and simply expire instead of being served with the wrong schema.
+BOOK_DETAIL_CACHE_VERSION = 4
+
+book_detail_cache_hits = Counter("bookly_book_detail_cache_hits_total", "Book detail reads served from redis")
+book_detail_cache_misses = Counter("bookly_book_detail_cache_misses_total", "Book detail reads that went to postgres")
+
+
+def book_detail_key(book_uid) -> str:
+    #canonical form, the entry written for one spelling of a uid must be the one invalidated for any other
+    return f"book:detail:v{BOOK_DETAIL_CACHE_VERSION}:{uuid.UUID(str(book_uid))}"
+
+
+#An entry is a hash of the json body and its validators, so a conditional GET can be answered
+#with a 304 straight from redis.
+#A redis outage must not take book reads down with it, every failure is logged and treated as a miss.
+async def get_cached_book_detail(book_uid) -> dict | None:
+    try:
+        entry = await redis_client.hgetall(book_detail_key(book_uid))
+    except RedisError as e:
+        logging.warning(f"book detail cache read failed: {e}")
+        entry = None
+    if not entry:
+        book_detail_cache_misses.inc()
+        return None
+    book_detail_cache_hits.inc()
+    last_modified = entry.get(b"last_modified")
+    return {
+        "body": entry[b"body"],
+        "etag": entry[b"etag"].decode(),
+        "last_modified": datetime.fromisoformat(last_modified.decode()) if last_modified else None,
+    }
+
+
+async def cache_book_detail(book_uid, body : str | bytes, etag : str, last_modified : datetime | None) -> None:
+    key = book_detail_key(book_uid)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                "body": body,
+                "etag": etag,
+                "last_modified": last_modified.isoformat() if last_modified else "",
+            })
+            pipe.expire(key, Config.BOOK_CACHE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"book detail cache write failed: {e}")
+
+
+async def invalidate_book_detail(*book_uids) -> None:
+    keys = [book_detail_key(book_uid) for book_uid in book_uids if book_uid is not None]
+    if not keys:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except RedisError as e:
+        logging.warning(f"book detail cache invalidation failed: {e}")
@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import logging
+from typing import Literal
+from redis.exceptions import RedisError
+from sqlmodel import select, func
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.config import Config
+from src.db.main import async_session_maker, async_engine
+from src.db.models import Book, Review
+from src.db.redis import redis_client
+
+#Book leaderboards kept in redis sorted sets, member = book uid:
+#  leaderboard:rating[:{language}]   average rating, only books with at least LEADERBOARD_MIN_REVIEWS reviews
+#  leaderboard:reviews[:{language}]  review count
+#The review write paths set the exact scores from the aggregates their UPDATE ... RETURNING gives back,
+#so an update is idempotent and a lost one is fixed by the next review of the book (or by a rebuild).
+#A book that was deleted or changed its language may linger in a set, readers skip it when they hydrate.
+
+LeaderboardName = Literal["rating", "reviews"]
+LEADERBOARDS = ("rating", "reviews")
+REBUILD_BATCH_SIZE = 1000
+
+
+def leaderboard_key(name : LeaderboardName, language : str | None = None) -> str:
+    return f"leaderboard:{name}:{language}" if language else f"leaderboard:{name}"
+
+
+def _scores(review_count : int, rating_sum : int) -> dict:
+    scores = {"reviews": review_count if review_count > 0 else None, "rating": None}
+    if review_count >= Config.LEADERBOARD_MIN_REVIEWS:
+        scores["rating"] = round(rating_sum / review_count, 4)
+    return scores
+
+
+async def update_leaderboards(*stats) -> None:
+    """stats are (uid, review_count, rating_sum, language) rows as returned by ReviewService.apply_rating_changes."""
+    stats = [row for row in stats if row is not None]
+    if not stats:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for uid, review_count, rating_sum, language in stats:
+                for name, score in _scores(review_count, rating_sum).items():
+                    for key in (leaderboard_key(name), leaderboard_key(name, language)):
+                        if score is None:
+                            pipe.zrem(key, str(uid))
+                        else:
+                            pipe.zadd(key, {str(uid): score})
+            await pipe.execute()
+    except RedisError as e:
+        #the scores are fixed by the next review of these books or by a rebuild
+        logging.warning(f"leaderboard update failed: {e}")
+
+
+async def remove_from_leaderboards(book_uid, language : str | None) -> None:
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for name in LEADERBOARDS:
+                pipe.zrem(leaderboard_key(name), str(book_uid))
+                if language:
+                    pipe.zrem(leaderboard_key(name, language), str(book_uid))
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"leaderboard removal failed: {e}")
+
+
+async def get_leaderboard(name : LeaderboardName, language : str | None, limit : int) -> list[str]:
+    """Book uids of the top limit entries, best first. Raises RedisError when redis is down."""
+    uids = await redis_client.zrevrange(leaderboard_key(name, language), 0, limit - 1)
+    return [uid.decode() for uid in uids]
+
+
+async def rebuild_leaderboards(session : AsyncSession, batch_size : int = REBUILD_BATCH_SIZE) -> int:
+    """Recompute every leaderboard from the reviews table and swap them in atomically.
+
+    Books are walked in uid order batch_size at a time and the reviews of each batch are aggregated with one
+    GROUP BY, the new sets are built under temporary keys and renamed over the live ones at the end,
+    so readers never see a half built leaderboard. Returns the number of books that have reviews.
+    """
+    #leftovers of a rebuild that died half way
+    leftovers = [key async for key in redis_client.scan_iter(match="leaderboard:*:rebuild")]
+    if leftovers:
+        await redis_client.delete(*leftovers)
+
+    building = {}
+    ranked = 0
+    last_uid = None
+    while True:
+        statement = select(Book.uid).order_by(Book.uid).limit(batch_size)
+        if last_uid is not None:
+            statement = statement.where(Book.uid > last_uid)
+        book_uids = (await session.exec(statement)).all()
+        if not book_uids:
+            break
+        last_uid = book_uids[-1]
+
+        statement = (
+            select(Book.uid, func.count(Review.uid), func.sum(Review.rating), Book.language)
+            .join(Review, Review.book_uid == Book.uid)
+            .where(Book.uid == any_(bindparam("uids", list(book_uids), type_=ARRAY(UUID(as_uuid=True)))))
+            .group_by(Book.uid, Book.language)
+        )
+        rows = (await session.exec(statement)).all()
+        ranked += len(rows)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for uid, review_count, rating_sum, language in rows:
+                for name, score in _scores(review_count, rating_sum).items():
+                    if score is None:
+                        continue
+                    for key in (leaderboard_key(name), leaderboard_key(name, language)):
+                        temporary_key = building.setdefault(key, f"{key}:rebuild")
+                        pipe.zadd(temporary_key, {str(uid): score})
+            await pipe.execute()
+
+    #leaderboards that ended up empty (e.g. a language without books any more) are dropped
+    stale_keys = [key async for key in redis_client.scan_iter(match="leaderboard:*")]
+    stale_keys = [key.decode() for key in stale_keys]
+    stale_keys = [key for key in stale_keys if key not in building and not key.endswith(":rebuild")]
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for key, temporary_key in building.items():
+            pipe.rename(temporary_key, key)
+        if stale_keys:
+            pipe.delete(*stale_keys)
+        await pipe.execute()
+    return ranked
+
+
+async def main(batch_size : int) -> None:
+    async with async_session_maker() as session:
+        ranked = await rebuild_leaderboards(session, batch_size)
+    print(f"rebuilt leaderboards from {ranked} reviewed books")
+    await async_engine.dispose()
+
+
+#python -m src.books.leaderboards --batch-size 1000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the book leaderboards from postgres")
+    parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+    asyncio.run(main(parser.parse_args().batch_size))
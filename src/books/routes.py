@@ -1,64 +1,342 @@
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, status, Depends, Query, Request
 from fastapi.exceptions import HTTPException
-from typing import List, Annotated
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from typing import List, Annotated, Literal, Union
 from src.db.main import get_session
-from src.books.schemas import Book, BookUpdateModel, BookCreateModel, BookDetailModel
+from src.books.schemas import Book, BookUpdateModel, BookCreateModel, BookDetailModel, BookPageModel, BookBulkResultModel, BookSearchPageModel, BookSuggestionModel, BookBatchModel, BookDetailBatchModel, BookLeaderboardModel
 from sqlmodel.ext.asyncio.session import AsyncSession
-from src.books.service import BookService
-from src.auth.dependencies import AccessTokenBearer, RoleChecker
+from src.books.service import BookService, SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT
+from src.books.cache import get_cached_book_detail, cache_book_detail
+from src.books.leaderboards import LeaderboardName, get_leaderboard
+from src.books.trending import get_trending
+from redis.exceptions import RedisError
+from src.reviews.service import ReviewService
+from src.reviews.schemas import ReviewModel, ReviewPageModel
+from src.reviews.queue import get_pending_reviews
+from src.config import Config
+from src.ratelimit import RateLimiter
+from src.auth.dependencies import AccessTokenDetails, RoleChecker
 from src.errors import BookNotFound
+from src.db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.fields import parse_fields, project
+from src.conditional import make_etag, latest, has_conditional_headers, is_not_modified, validator_headers, not_modified
+import logging
+import orjson
+import uuid
 
 book_router = APIRouter()
 book_service = BookService()
-access_token_bearer = AccessTokenBearer()
+review_service = ReviewService()
 
 MyAsyncSession = Annotated[AsyncSession, Depends(get_session)]
-TokenDetails = Annotated[dict,Depends(access_token_bearer)]
+#the bearer instance RoleChecker depends on, FastAPI then runs it once per request
+TokenDetails = AccessTokenDetails
+PageLimit = Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)]
+#?uids=a,b,c or ?uids=a&uids=b
+Uids = Annotated[List[str], Query(description=f"Book uids to look up, at most 100")]
+#?fields=uid,title,author returns only those fields, read from a column-only select
+Fields = Annotated[str | None, Query(description="Comma separated list of fields to return")]
 
 role_checker = RoleChecker(["admin", "user"])
 authorize = Depends(role_checker)
+#checked before authorize, a client over its limit costs no token or principal lookup
+write_rate_limit = Depends(RateLimiter(Config.RATE_LIMIT_WRITES))
 
-@book_router.get("/", response_model=List[Book], dependencies=[authorize])
-async def get_all_books(session : MyAsyncSession, token_details : TokenDetails):
+BULK_MAX_ITEMS = 50_000
+BATCH_MAX_UIDS = 100
+
+
+def parse_uids(values : List[str]) -> List[uuid.UUID]:
+    try:
+        uids = [uuid.UUID(uid.strip()) for value in values for uid in value.split(",") if uid.strip()]
+    except ValueError:
+        raise HTTPException(detail="uids must be valid UUIDs", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    #duplicates are answered once
+    uids = list(dict.fromkeys(uids))
+    if len(uids) > BATCH_MAX_UIDS:
+        raise HTTPException(
+            detail=f"At most {BATCH_MAX_UIDS} books can be looked up at once",
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return uids
+
+
+def book_detail(book, reviews_page : dict) -> BookDetailModel:
+    #the book is loaded without its reviews, only the first page of them is embedded
+    detail = BookDetailModel.model_validate(book, from_attributes=True)
+    return detail.model_copy(update={
+        "reviews": [ReviewModel.model_validate(review, from_attributes=True) for review in reviews_page["items"]],
+        "reviews_next_cursor": reviews_page["next_cursor"],
+    })
+
+
+def books_batch_response(batch : dict, fields : tuple[str, ...] | None, include_reviews : bool) -> Response:
+    if fields is not None:
+        return JSONResponse(content={
+            "items": project(Book, fields, batch["items"]),
+            "missing": [str(uid) for uid in batch["missing"]],
+        })
+    model = BookDetailBatchModel if include_reviews else BookBatchModel
+    return Response(
+        content=model.model_validate(batch, from_attributes=True).model_dump_json(),
+        media_type="application/json",
+    )
+
+
+#a book representation only changes when one of these does
+BOOK_VERSION_FIELDS = ("uid", "update_at", "reviews_updated_at")
+
+
+def book_validators(book) -> tuple:
+    return make_etag(book.uid, book.update_at, book.reviews_updated_at), latest((book.update_at, book.reviews_updated_at))
+
+
+def page_etag(page : dict) -> str:
+    #a list page has no meaningful Last-Modified (a book leaving the page does not move it), only an ETag
+    return make_etag(page["next_cursor"], *(f"{book.uid}/{book.update_at}/{book.reviews_updated_at}" for book in page["items"]))
+
+
+def books_page_response(page : dict, fields : tuple[str, ...] | None, response : Response):
+    if fields is None:
+        response.headers.update(validator_headers(page_etag(page)))
+        return page
+    #projected rows do not match BookPageModel, so they skip response_model validation entirely
+    return JSONResponse(content={"items": project(Book, fields, page["items"]), "next_cursor": page["next_cursor"]})
+
+
+def parse_bulk_body(body : bytes, content_type : str) -> list:
+    """A bulk body is either a JSON array or NDJSON (one JSON object per line).
+    A NDJSON line that is not valid JSON is kept as a raw string so it is reported as a failed row."""
+    if content_type.startswith("application/x-ndjson"):
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                items.append(line.decode(errors="replace"))
+    else:
+        try:
+            items = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            items = None
+        if not isinstance(items, list):
+            raise HTTPException(
+                detail="Body must be a JSON array or NDJSON", status_code=status.HTTP_400_BAD_REQUEST
+            )
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(
+            detail=f"At most {BULK_MAX_ITEMS} books can be created in one request",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    return items
+
+@book_router.get("/", response_model=BookPageModel, dependencies=[authorize])
+async def get_all_books(request : Request, response : Response, session : MyAsyncSession, token_details : TokenDetails,
+                        limit : PageLimit = DEFAULT_PAGE_SIZE, cursor : str | None = None, fields : Fields = None):
     #token_details : {'user': {'email': 'kemal@dmca.io', 'user_uid': '2e53a352-c25f-61cd281461'},
     #            'exp': 1729468596, 'jti': '<function uuid4 at 0x100f5cc20>', 'refresh': False}
-    books = await book_service.get_all_books(session)
-    return books
+    selected = parse_fields(fields, Book)
+    if selected is None and has_conditional_headers(request):
+        versions = await book_service.get_all_books(session, limit, cursor, BOOK_VERSION_FIELDS)
+        etag = page_etag(versions)
+        if is_not_modified(request, etag):
+            return not_modified(validator_headers(etag))
+    page = await book_service.get_all_books(session, limit, cursor, selected)
+    return books_page_response(page, selected, response)
+
+#?uids=a,b,c looks up several books in one request, in the order asked for, unknown uids are listed in missing.
+#?include=reviews adds the first review page of every book (BookDetailBatchModel instead of BookBatchModel).
+@book_router.get("/batch", response_model=Union[BookDetailBatchModel, BookBatchModel], dependencies=[authorize])
+async def get_books_batch(uids : Uids, session : MyAsyncSession, token_details : TokenDetails, fields : Fields = None,
+                          include : Literal["reviews"] | None = None):
+    selected = parse_fields(fields, Book)
+    batch = await book_service.get_books_by_uids(parse_uids(uids), session, selected)
+    include_reviews = include == "reviews" and selected is None
+    if include_reviews and batch["items"]:
+        #one query for the first review page of every book in the batch
+        pages = await review_service.get_first_review_pages([book.uid for book in batch["items"]], session)
+        batch["items"] = [book_detail(book, pages[book.uid]) for book in batch["items"]]
+    return books_batch_response(batch, selected, include_reviews)
 
-@book_router.get("/user/{user_uid}", response_model=List[Book], dependencies=[authorize])
-async def get_user_book_submissions(user_uid : str , session : MyAsyncSession, token_details : TokenDetails):
+@book_router.get("/user/{user_uid}", response_model=BookPageModel, dependencies=[authorize])
+async def get_user_book_submissions(user_uid : str , request : Request, response : Response, session : MyAsyncSession,
+                                    token_details : TokenDetails, limit : PageLimit = DEFAULT_PAGE_SIZE,
+                                    cursor : str | None = None, fields : Fields = None):
     #token_details : {'user': {'email': 'kemal@dmca.io', 'user_uid': '2e53a352-c25f-61cd281461'},
     #            'exp': 1729468596, 'jti': '<function uuid4 at 0x100f5cc20>', 'refresh': False}
-    books = await book_service.get_user_books(user_uid,session)
-    return books
+    selected = parse_fields(fields, Book)
+    if selected is None and has_conditional_headers(request):
+        versions = await book_service.get_user_books(user_uid, session, limit, cursor, BOOK_VERSION_FIELDS)
+        etag = page_etag(versions)
+        if is_not_modified(request, etag):
+            return not_modified(validator_headers(etag))
+    page = await book_service.get_user_books(user_uid, session, limit, cursor, selected)
+    return books_page_response(page, selected, response)
+
+
 
+@book_router.get("/search", response_model=BookSearchPageModel, dependencies=[authorize])
+async def search_books(q : Annotated[str, Query(min_length=1, max_length=200)], session : MyAsyncSession,
+                       token_details : TokenDetails, limit : PageLimit = DEFAULT_PAGE_SIZE, cursor : str | None = None):
+    page = await book_service.search_books(q, session, limit, cursor)
+    return page
 
 
-@book_router.post("/", status_code=status.HTTP_201_CREATED , response_model=Book, dependencies=[authorize])
+@book_router.get("/suggest", response_model=List[BookSuggestionModel], dependencies=[authorize])
+async def suggest_books(prefix : Annotated[str, Query(min_length=1, max_length=100)], session : MyAsyncSession,
+                        token_details : TokenDetails,
+                        limit : Annotated[int, Query(ge=1, le=SUGGEST_MAX_LIMIT)] = SUGGEST_DEFAULT_LIMIT):
+    suggestions = await book_service.suggest_books(prefix, session, limit)
+    return suggestions
+
+
+@book_router.get("/top", response_model=BookLeaderboardModel, dependencies=[authorize])
+async def get_top_books(session : MyAsyncSession, token_details : TokenDetails, by : LeaderboardName = "rating",
+                        language : str | None = None, limit : PageLimit = DEFAULT_PAGE_SIZE):
+    try:
+        uids = await get_leaderboard(by, language, limit)
+    except RedisError as e:
+        logging.warning(f"leaderboard read failed, ranking in postgres: {e}")
+        return {"items": await book_service.get_top_books(by, language, limit, session)}
+    batch = await book_service.get_books_by_uids([uuid.UUID(uid) for uid in uids], session)
+    #deleted books are missing from the batch, a book that changed its language is skipped here
+    items = [book for book in batch["items"] if language is None or book.language == language]
+    return {"items": items}
+
+
+@book_router.get("/trending", response_model=BookLeaderboardModel, dependencies=[authorize])
+async def get_trending_books(session : MyAsyncSession, token_details : TokenDetails, limit : PageLimit = DEFAULT_PAGE_SIZE):
+    try:
+        uids = await get_trending(limit)
+    except RedisError as e:
+        logging.warning(f"trending read failed: {e}")
+        uids = []
+    if not uids:
+        return {"items": []}
+    batch = await book_service.get_books_by_uids([uuid.UUID(uid) for uid in uids], session)
+    return {"items": batch["items"]}
+
+
+@book_router.get("/export", dependencies=[authorize])
+async def export_books(token_details : TokenDetails,
+                       export_format : Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson"):
+    if export_format == "csv":
+        return StreamingResponse(
+            book_service.export_books(export_format),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="books.csv"'},
+        )
+    return StreamingResponse(book_service.export_books(export_format), media_type="application/x-ndjson")
+
+
+@book_router.post("/", status_code=status.HTTP_201_CREATED , response_model=Book, dependencies=[write_rate_limit, authorize])
 async def create_a_book(book_data : BookCreateModel, session : MyAsyncSession, token_details: TokenDetails): 
     user_id = token_details['user']['user_uid']
     new_book = await book_service.create_book(book_data, user_id ,session)
     return new_book
 
 
+@book_router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=BookBulkResultModel, dependencies=[write_rate_limit, authorize])
+async def create_books_bulk(request : Request, session : MyAsyncSession, token_details: TokenDetails):
+    items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    user_id = token_details['user']['user_uid']
+    result = await book_service.create_books_bulk(items, user_id, session)
+    return result
+
+
 @book_router.get("/{book_uid}" , response_model=BookDetailModel, dependencies=[authorize])
-async def get_book(book_uid : str, session : MyAsyncSession, token_details: TokenDetails):
+async def get_book(book_uid : uuid.UUID, request : Request, session : MyAsyncSession, token_details: TokenDetails,
+                   fields : Fields = None):
+    selected = parse_fields(fields, Book)
+    if selected is not None:
+        book = await book_service.get_book_fields(book_uid, selected, session)
+        if not book:
+            raise BookNotFound()
+        return JSONResponse(content=project(Book, selected, [book])[0])
+
+    #read-through cache: a hit is returned (or answered with a 304) as is, without touching postgres
+    cached = await get_cached_book_detail(book_uid)
+    if cached is not None:
+        headers = validator_headers(cached["etag"], cached["last_modified"])
+        if is_not_modified(request, cached["etag"], cached["last_modified"]):
+            return not_modified(headers)
+        return Response(content=cached["body"], media_type="application/json", headers=headers)
+
+    if has_conditional_headers(request):
+        #the version columns alone decide a 304, the book and its reviews are only loaded when it changed
+        version = await book_service.get_book_fields(book_uid, BOOK_VERSION_FIELDS, session)
+        if not version:
+            raise BookNotFound()
+        etag, last_modified = book_validators(version)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(validator_headers(etag, last_modified))
+
     book = await book_service.get_book(book_uid, session)
-    if book:
-        return book
-    raise BookNotFound()
+    if not book:
+        raise BookNotFound()
+    etag, last_modified = book_validators(book)
+    reviews_page = await review_service.get_book_reviews(book.uid, session)
+    body = book_detail(book, reviews_page).model_dump_json()
+    await cache_book_detail(book_uid, body, etag, last_modified)
+    return Response(content=body, media_type="application/json", headers=validator_headers(etag, last_modified))
+
+
+@book_router.get("/{book_uid}/reviews", response_model=ReviewPageModel, dependencies=[authorize])
+async def get_book_reviews(book_uid : uuid.UUID, request : Request, response : Response, session : MyAsyncSession,
+                           token_details : TokenDetails, limit : PageLimit = DEFAULT_PAGE_SIZE, cursor : str | None = None,
+                           sort : Literal["newest", "rating"] = "newest", fields : Fields = None):
+    selected = parse_fields(fields, ReviewModel)
+    #the review list of a book only changes when its reviews_updated_at does,
+    #so this primary key lookup answers both the 404 and a conditional GET
+    version = await book_service.get_book_fields(book_uid, ("uid", "reviews_updated_at"), session)
+    if not version:
+        raise BookNotFound()
+    pending = []
+    if Config.REVIEW_WRITE_BEHIND and cursor is None and sort == "newest":
+        #read-your-writes: the author's queued reviews top the newest page until their batch is flushed,
+        #the page is then specific to this user and never answered with a 304
+        pending = await get_pending_reviews(token_details["user"]["user_uid"], book_uid)
+    etag = make_etag(version.uid, version.reviews_updated_at, sort, limit, cursor, selected)
+    headers = validator_headers(etag, version.reviews_updated_at)
+    if not pending and is_not_modified(request, etag, version.reviews_updated_at):
+        return not_modified(headers)
+
+    page = await review_service.get_book_reviews(book_uid, session, limit, cursor, sort, selected)
+    #a review whose batch was committed but not acknowledged yet is already on the page
+    on_page = {review.uid for review in page["items"]}
+    pending = [review for review in pending if review.uid not in on_page]
+    if pending:
+        if selected is not None:
+            items = [review.model_dump(mode="json", include=set(selected)) for review in pending]
+            items += project(ReviewModel, selected, page["items"])
+        else:
+            items = [review.model_dump(mode="json") for review in pending]
+            items += [ReviewModel.model_validate(review, from_attributes=True).model_dump(mode="json") for review in page["items"]]
+        return JSONResponse(
+            content={"items": items, "next_cursor": page["next_cursor"]},
+            headers={"Cache-Control": "private, no-store"},
+        )
+    if selected is not None:
+        return JSONResponse(
+            content={"items": project(ReviewModel, selected, page["items"]), "next_cursor": page["next_cursor"]},
+            headers=headers,
+        )
+    response.headers.update(headers)
+    return page
 
 
-@book_router.patch("/{book_uid}", response_model=Book, dependencies=[authorize])
-async def update_book(book_uid : str, book_update_data : BookUpdateModel, session : MyAsyncSession, token_details: TokenDetails) :
+@book_router.patch("/{book_uid}", response_model=Book, dependencies=[write_rate_limit, authorize])
+async def update_book(book_uid : uuid.UUID, book_update_data : BookUpdateModel, session : MyAsyncSession, token_details: TokenDetails) :
     updated_book = await book_service.update_book(book_uid, book_update_data, session )
     if updated_book:
         return updated_book
     raise BookNotFound()
 
 
-@book_router.delete("/{book_uid}", dependencies=[authorize])
-async def delete_book(book_uid : str, session : MyAsyncSession, token_details: TokenDetails):
+@book_router.delete("/{book_uid}", dependencies=[write_rate_limit, authorize])
+async def delete_book(book_uid : uuid.UUID, session : MyAsyncSession, token_details: TokenDetails):
     book_to_delete = await book_service.delete_book(book_uid, session)
     if book_to_delete is None:
         raise BookNotFound()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, computed_field
 from typing import Optional, List
 from src.reviews.schemas import ReviewModel
 import uuid
@@ -14,9 +14,27 @@ class Book(BaseModel):
     language: str
     created_at : datetime
     update_at : datetime
+    review_count : int = 0
+    rating_sum : int = Field(default=0, exclude=True)
+    #number of 1 ... 5 star reviews
+    rating_histogram : List[int] = Field(default_factory=lambda: [0] * 5)
+
+    @computed_field
+    @property
+    def average_rating(self) -> Optional[float]:
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
 
 class BookDetailModel(Book):
+    #only the newest page of reviews, the rest is at GET /books/{book_uid}/reviews?cursor=reviews_next_cursor
     reviews: List[ReviewModel]
+    reviews_next_cursor: Optional[str] = None
+
+class BookPageModel(BaseModel):
+    items: List[Book]
+    #pass it back as ?cursor= to get the next page, None means this is the last page
+    next_cursor: Optional[str] = None
 
 class BookCreateModel(BaseModel):
     title: Optional[str] = None
@@ -27,6 +45,56 @@ class BookCreateModel(BaseModel):
     published_date : Optional[date] = None
 
 
+class BookBatchModel(BaseModel):
+    #in the order they were asked for
+    items: List[Book]
+    missing: List[uuid.UUID]
+
+class BookDetailBatchModel(BookBatchModel):
+    items: List[BookDetailModel]
+
+
+class BookSearchResultModel(Book):
+    rank: float
+
+class BookSearchPageModel(BaseModel):
+    items: List[BookSearchResultModel]
+    next_cursor: Optional[str] = None
+
+
+class BookLeaderboardModel(BaseModel):
+    #best first
+    items: List[Book]
+
+
+class BookSuggestionModel(BaseModel):
+    uid : uuid.UUID
+    title: str
+    author : str
+
+
+class BookBulkCreateModel(BookCreateModel):
+    #every column is NOT NULL, so a bulk row has to carry all of them to be insertable
+    title: str
+    author: str
+    publisher: str
+    page_count: int
+    language: str
+    published_date : date
+
+
+class BookBulkErrorModel(BaseModel):
+    #position of the rejected item in the request body
+    index: int
+    errors: List[dict]
+
+
+class BookBulkResultModel(BaseModel):
+    inserted: int
+    uids: List[uuid.UUID]
+    errors: List[BookBulkErrorModel]
+
+
 class BookUpdateModel(BaseModel):
     title: Optional[str] = None
     author: Optional[str] = None
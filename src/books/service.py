@@ -1,34 +1,220 @@
 #A session object is a way to manage database connections and transactions.
 #It acts as an interface between your application code and the database.
 from sqlmodel.ext.asyncio.session import AsyncSession
-from .schemas import BookCreateModel, BookUpdateModel
+from .schemas import BookCreateModel, BookUpdateModel, BookBulkCreateModel
 from sqlmodel import select, desc
+from sqlalchemy import tuple_, insert, update, delete, func, column, literal_column, or_, any_, bindparam
+from sqlalchemy.dialects.postgresql import TSVECTOR, ARRAY, UUID
+from sqlalchemy.orm import noload
 from src.db.models import Book
+from src.db.main import async_session_maker
+from src.db.pagination import DEFAULT_PAGE_SIZE, decode_cursor, next_cursor
+from src.cache import TTLCache
+from .cache import invalidate_book_detail
+from .leaderboards import LeaderboardName, remove_from_leaderboards
+from src.config import Config
+from typing import Any, AsyncIterator, Sequence
+from pydantic import ValidationError
 from datetime import datetime
+import orjson
+import uuid
+import csv
+import io
+
+EXPORT_COLUMNS = [
+    "uid", "title", "author", "publisher", "published_date",
+    "page_count", "language", "user_uid", "created_at", "update_at",
+]
+#rows fetched per server-side cursor round trip, also the size of every streamed chunk
+EXPORT_BATCH_SIZE = 1000
+#rows per multi-row INSERT, 10 columns * 1000 rows stays well below the 32767 bind parameter limit of postgres
+BULK_INSERT_CHUNK_SIZE = 1000
+
+
+#books.search_vector is a generated (title A, author B, publisher C) tsvector kept up to date by postgres.
+#It is not mapped on the Book model so select(Book) never loads it.
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+search_vector = column("search_vector", TSVECTOR)
+
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+#shorter prefixes have no usable trigrams, they are answered from the title btree (ix_books_title_lower_c)
+SUGGEST_TRIGRAM_MIN_LENGTH = 3
+#autocomplete fires on every keystroke and many users type the same first letters,
+#a few seconds of staleness is fine for suggestions
+suggest_cache = TTLCache(maxsize=10_000, ttl=30)
+
+
+def books_to_ndjson(rows : Sequence) -> bytes:
+    #orjson writes UUID, date and datetime natively
+    return b"".join(orjson.dumps(dict(row)) + b"\n" for row in rows)
+
+
+def books_to_csv(rows : Sequence) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue().encode()
 
 class BookService:
     #Sessions are used to interact with the database:
-    async def get_all_books(self, session:AsyncSession):
-        statement = select(Book).order_by(desc(Book.created_at))
-        result = await session.exec(statement)
-        return result.all()
+    async def get_all_books(self, session:AsyncSession, limit : int = DEFAULT_PAGE_SIZE, cursor : str | None = None,
+                            fields : tuple[str, ...] | None = None):
+        statement = self._select_books(fields, extra_columns=("created_at", "uid"))
+        return await self._get_books_page(statement, limit, cursor, session)
     
-    async def get_user_books(self,user_id : str,  session:AsyncSession):
-        statement = select(Book).where(Book.user_uid == user_id)
+    async def get_user_books(self,user_id : str,  session:AsyncSession, limit : int = DEFAULT_PAGE_SIZE, cursor : str | None = None,
+                             fields : tuple[str, ...] | None = None):
+        statement = self._select_books(fields, extra_columns=("created_at", "uid")).where(Book.user_uid == user_id)
+        return await self._get_books_page(statement, limit, cursor, session)
+
+    def _select_books(self, fields : tuple[str, ...] | None, extra_columns : tuple[str, ...] = ()):
+        """select(Book) without its reviews, or only the requested columns when a sparse fieldset is asked for.
+        extra_columns are selected too (e.g. the pagination key) but left to the caller to hide."""
+        if fields is None:
+            #list responses never show reviews, so do not let the selectin relationship load them
+            return select(Book).options(noload(Book.reviews))
+        names = dict.fromkeys((*fields, *extra_columns))
+        return select(*[Book.__table__.c[name] for name in names])
+
+    async def _get_books_page(self, statement, limit : int, cursor : str | None, session:AsyncSession) -> dict:
+        #newest first, uid breaks ties between books created in the same microsecond.
+        #served by the (created_at, uid) / (user_uid, created_at, uid) indexes.
+        if cursor:
+            created_at, uid = decode_cursor(cursor, datetime.fromisoformat, uuid.UUID)
+            statement = statement.where(tuple_(Book.created_at, Book.uid) < (created_at, uid))
+        statement = statement.order_by(desc(Book.created_at), desc(Book.uid)).limit(limit + 1)
         result = await session.exec(statement)
+        books = result.all()
+        return {
+            "items": books[:limit],
+            "next_cursor": next_cursor(books, limit, key=lambda book: (book.created_at, book.uid)),
+        }
+
+    async def search_books(self, q : str, session:AsyncSession, limit : int = DEFAULT_PAGE_SIZE, cursor : str | None = None) -> dict:
+        #websearch_to_tsquery understands "quoted phrases", or and -negation and never fails on user input.
+        #@@ is answered by the GIN index on search_vector, only the matches get ranked.
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        rank = func.ts_rank(search_vector, query)
+        statement = select(Book, rank).where(search_vector.op("@@")(query))
+        if cursor:
+            last_rank, uid = decode_cursor(cursor, float, uuid.UUID)
+            statement = statement.where(tuple_(rank, Book.uid) < (last_rank, uid))
+        statement = (
+            statement.options(noload(Book.reviews))
+            .order_by(rank.desc(), Book.uid.desc())
+            .limit(limit + 1)
+        )
+        result = await session.exec(statement)
+        rows = result.all()
+        return {
+            "items": [{**book.model_dump(), "rank": book_rank} for book, book_rank in rows[:limit]],
+            "next_cursor": next_cursor(rows, limit, key=lambda row: (row[1], row[0].uid)),
+        }
+
+    async def suggest_books(self, prefix : str, session:AsyncSession, limit : int = SUGGEST_DEFAULT_LIMIT) -> list[dict]:
+        prefix = " ".join(prefix.lower().split())
+        cache_key = (prefix, limit)
+        suggestions = suggest_cache.get(cache_key)
+        if suggestions is not None:
+            return suggestions
+
+        if len(prefix) < SUGGEST_TRIGRAM_MIN_LENGTH:
+            #"a" would match most of the catalog through the trigram indexes and all of it would be ranked
+            #before the LIMIT. Titles starting with the prefix in title order instead: a range scan of
+            #ix_books_title_lower_c that stops after limit rows. A range rather than LIKE, so a generic plan
+            #of the prepared statement can use the index too.
+            title_key = func.lower(Book.title).collate("C")
+            statement = select(Book.uid, Book.title, Book.author).where(title_key >= prefix)
+            if ord(prefix[-1]) < 0x10FFFF:
+                statement = statement.where(title_key < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+            statement = statement.order_by(title_key).limit(limit)
+        else:
+            statement = self._similar_books(prefix, limit)
+        result = await session.exec(statement)
+        suggestions = [{"uid": uid, "title": title, "author": author} for uid, title, author in result.all()]
+        suggest_cache.set(cache_key, suggestions)
+        return suggestions
+
+    def _similar_books(self, prefix : str, limit : int):
+        #"tolk%" prefix matches and "tolkein" typos (word similarity, %>) are both answered by
+        #the gin_trgm_ops indexes on title and author. Only the three columns are fetched, no ORM objects.
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        similarity = func.greatest(func.word_similarity(prefix, Book.title), func.word_similarity(prefix, Book.author))
+        return (
+            select(Book.uid, Book.title, Book.author)
+            .where(or_(
+                Book.title.ilike(pattern),
+                Book.author.ilike(pattern),
+                Book.title.op("%>")(prefix),
+                Book.author.op("%>")(prefix),
+            ))
+            .order_by(similarity.desc(), Book.title)
+            .limit(limit)
+        )
+
+    async def export_books(self, export_format : str) -> AsyncIterator[bytes]:
+        """Stream the whole catalog as ndjson or csv chunks.
+
+        Rows come from a server-side cursor as plain column tuples (no ORM objects, no reviews),
+        so memory stays at one batch no matter how big the table is.
+        The session is opened here and not taken from get_session because
+        a StreamingResponse body is sent after request dependencies are closed.
+        """
+        encode = books_to_csv if export_format == "csv" else books_to_ndjson
+        if export_format == "csv":
+            yield (",".join(EXPORT_COLUMNS) + "\r\n").encode()
+
+        statement = (
+            select(*[Book.__table__.c[column] for column in EXPORT_COLUMNS])
+            .order_by(Book.created_at, Book.uid)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async with async_session_maker() as session:
+            result = await session.stream(statement)
+            async for rows in result.mappings().partitions():
+                yield encode(rows)
+
+    async def get_top_books(self, by : LeaderboardName, language : str | None, limit : int, session:AsyncSession) -> list:
+        """The leaderboards computed by postgres, only used while redis (src/books/leaderboards.py) is unavailable.
+        It sorts every reviewed book on each call."""
+        statement = self._select_books(None).where(Book.review_count >= (Config.LEADERBOARD_MIN_REVIEWS if by == "rating" else 1))
+        if language:
+            statement = statement.where(Book.language == language)
+        score = Book.rating_sum * 1.0 / Book.review_count if by == "rating" else Book.review_count
+        result = await session.exec(statement.order_by(score.desc(), Book.uid).limit(limit))
         return result.all()
 
+    async def get_books_by_uids(self, uids : list[uuid.UUID], session:AsyncSession,
+                                fields : tuple[str, ...] | None = None) -> dict:
+        """Resolve many books with one "uid = ANY(:uids)" query, without their reviews.
+        Books come back in the order of uids, uids without a book are listed in missing."""
+        statement = self._select_books(fields, extra_columns=("uid",))
+        #a single array parameter instead of one bind parameter per uid
+        statement = statement.where(Book.uid == any_(bindparam("uids", uids, type_=ARRAY(UUID(as_uuid=True)))))
+        result = await session.exec(statement)
+        books = {book.uid: book for book in result.all()}
+        return {
+            "items": [books[uid] for uid in uids if uid in books],
+            "missing": [uid for uid in uids if uid not in books],
+        }
+
+    async def get_book_fields(self, book_uid : str, fields : tuple[str, ...], session:AsyncSession):
+        statement = self._select_books(fields).where(Book.uid == book_uid)
+        result = await session.exec(statement)
+        return result.first()
+
     async def get_book(self, book_uid : str ,session:AsyncSession) -> dict:
-        statement = select(Book).where(Book.uid == book_uid )
+        #reviews are paginated (ReviewService.get_book_reviews), never loaded all at once through the relationship
+        statement = select(Book).options(noload(Book.reviews)).where(Book.uid == book_uid )
         result = await session.exec(statement)
         book = result.first()
         return book if book else None
 
     async def create_book(self, book_data : BookCreateModel, user_uid : str, session:AsyncSession):
         book_dict = book_data.model_dump(exclude_unset=True)
+        #published_date is already a date, pydantic parsed it while validating the request body
         new_book = Book(**book_dict)
-        if book_dict.get('published_date'):
-            new_book.published_date = datetime.strptime(str(book_dict['published_date']), "%Y-%m-%d")
         new_book.user_uid = user_uid
         #adding an object to the session marks it as pending, meaning it will be inserted into the database when the transaction is committed.
         #session.add() is not an asynchronous operation because It's not communicating with the database at this point
@@ -37,36 +223,79 @@ class BookService:
         await session.commit()
         return new_book
 
+    async def create_books_bulk(self, items : list[Any], user_uid : str, session:AsyncSession) -> dict:
+        """Validate every item on its own and insert the valid ones with multi-row INSERT ... RETURNING.
+
+        An invalid item is reported back with its index instead of failing the whole request.
+        All chunks are written in one transaction with one commit.
+        """
+        rows = []
+        errors = []
+        for index, item in enumerate(items):
+            try:
+                book_data = BookBulkCreateModel.model_validate(item)
+            except ValidationError as e:
+                errors.append({"index": index, "errors": orjson.loads(e.json(include_url=False))})
+                continue
+            now = datetime.now()
+            rows.append({
+                **book_data.model_dump(),
+                "uid": uuid.uuid4(),
+                "user_uid": user_uid,
+                "created_at": now,
+                "update_at": now,
+            })
+
+        uids = []
+        for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+            result = await session.execute(insert(Book).values(chunk).returning(Book.uid))
+            uids.extend(result.scalars().all())
+        if uids:
+            await session.commit()
+
+        return {"inserted": len(uids), "uids": uids, "errors": errors}
+
     async def update_book(self, book_uid : str , update_data : BookUpdateModel, session:AsyncSession):
-        book_to_update = await self.get_book(book_uid,session)
-        if book_to_update is None:
+        #This prevents None values or default values from overwriting existing fields in the database.
+        #None olan key-value'lari siliyor. Bosuna yer kaplamiyorlar.ß
+        """
+        With exclude_unset == True , {"title": "New Title"}
+        Without exclude_unset == True , {"title": "New Title","author": None, "published_date": None }
+        """
+        update_data_dict = update_data.model_dump(exclude_unset=True)
+        #One round trip: UPDATE ... RETURNING gives back the updated row, there is no fetch before and no refresh after.
+        #update_at is the book's version (ETags / Last-Modified). It comes from the app's clock like the
+        #column default, postgres now() may be in another time zone than the naive datetimes stored here.
+        statement = (
+            update(Book)
+            .where(Book.uid == book_uid)
+            .values(**update_data_dict, update_at=datetime.now())
+            .returning(*Book.__table__.columns)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(statement)
+        updated_book = result.mappings().first()
+        if updated_book is None:
             return None
-        if book_to_update:
-            #This prevents None values or default values from overwriting existing fields in the database.
-            #None olan key-value'lari siliyor. Bosuna yer kaplamiyorlar.ß
-            """
-            With exclude_unset == True , {"title": "New Title"}
-            Without exclude_unset == True , {"title": "New Title","author": None, "published_date": None }
-            """
-            update_data_dict = update_data.model_dump(exclude_unset=True)
-            book_to_update.sqlmodel_update(update_data_dict)
-            #Adds the modified book instance to the session, Marks it for update in the database
-            session.add(book_to_update)
-            await session.commit()
-            #Refreshes the book instance from the database, Ensures we have the most up-to-date data
-            await session.refresh(book_to_update)
-            return book_to_update
+        await session.commit()
+        await invalidate_book_detail(book_uid)
+        return dict(updated_book)
     
 
     async def delete_book(self, book_uid : str ,session:AsyncSession):
-        book_to_delete = await self.get_book(book_uid,session)
-
-        if book_to_delete is not None:
-            await session.delete(book_to_delete)
+        #reviews of the book keep existing with book_uid set to NULL (ON DELETE SET NULL)
+        statement = delete(Book).where(Book.uid == book_uid).returning(Book.uid, Book.language)
+        result = await session.execute(statement)
+        deleted_book = result.first()
 
+        if deleted_book is not None:
             await session.commit()
 
+            await invalidate_book_detail(book_uid)
+            await remove_from_leaderboards(book_uid, deleted_book.language)
+
             return {}
 
         else:
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,58 @@
+import logging
+import time
+from redis import Redis
+from redis.exceptions import RedisError
+from src.config import Config
+from src.db.redis import redis_client
+
+#"Trending this week" from review activity, without aggregating the reviews table.
+#Every review bumps its book in the bucket of the current hour (trending:bucket:{hour}).
+#merge_trending_buckets (a celery beat task) folds the buckets of the last TRENDING_WINDOW_HOURS into
+#trending:books with ZUNIONSTORE, each bucket weighted by 0.5 ** (age / TRENDING_HALF_LIFE_HOURS),
+#so a review from yesterday counts half as much as one from this hour (with the default half life).
+#Reading the top of trending:books is then a single ZREVRANGE.
+
+TRENDING_KEY = "trending:books"
+BUCKET_SECONDS = 3600
+
+
+def bucket_key(hour : int) -> str:
+    return f"trending:bucket:{hour}"
+
+
+def current_hour(now : float | None = None) -> int:
+    return int((time.time() if now is None else now) // BUCKET_SECONDS)
+
+
+async def record_review_activity(counts : dict) -> None:
+    """counts maps book uid -> number of new reviews."""
+    counts = {book_uid: count for book_uid, count in counts.items() if book_uid is not None and count}
+    if not counts:
+        return
+    key = bucket_key(current_hour())
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for book_uid, count in counts.items():
+                pipe.zincrby(key, count, str(book_uid))
+            #a bucket is only read while it is inside the window
+            pipe.expire(key, (Config.TRENDING_WINDOW_HOURS + 1) * BUCKET_SECONDS)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"trending update failed: {e}")
+
+
+def merge_trending_buckets(client : Redis, now : float | None = None) -> None:
+    """Rebuild trending:books from the hourly buckets. Runs in the celery worker, hence the sync client."""
+    hour = current_hour(now)
+    weights = {
+        bucket_key(hour - age): 0.5 ** (age / Config.TRENDING_HALF_LIFE_HOURS)
+        for age in range(Config.TRENDING_WINDOW_HOURS)
+    }
+    #missing buckets (quiet hours) count as empty sets, ZUNIONSTORE replaces the ranking atomically
+    client.zunionstore(TRENDING_KEY, weights, aggregate="SUM")
+
+
+async def get_trending(limit : int) -> list[str]:
+    """Book uids of the limit hottest books, hottest first. Raises RedisError when redis is down."""
+    uids = await redis_client.zrevrange(TRENDING_KEY, 0, limit - 1)
+    return [uid.decode() for uid in uids]
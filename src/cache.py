@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after ttl seconds.
+
+    Every worker process has its own copy, so it is only used for data that may be
+    a few seconds stale or that is invalidated explicitly. It is not thread safe,
+    it is meant to be used from the event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        #most recently used entries live at the end, evictions happen at the front
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,15 +1,23 @@
 from celery import Celery
 from src.mail import mail, create_message
 from asgiref.sync import async_to_sync
+from redis import Redis
+from src.config import Config
+from src.books.trending import merge_trending_buckets
 
 c_app = Celery()
 
 c_app.config_from_object("src.config")
 
+#the tasks are sync, so they get a sync redis client of their own
+redis_sync_client = Redis.from_url(Config.REDIS_URL)
+
 #for celery worker
 #celery -A src.celery_tasks.c_app worker
 #for flower
 #celery -A src.celery_tasks.c_app flower
+#for the periodic tasks (beat_schedule in src/config.py)
+#celery -A src.celery_tasks.c_app beat
 
 @c_app.task()
 def send_email(recipients: list[str], subject: str, body: str):
@@ -19,4 +27,9 @@ def send_email(recipients: list[str], subject: str, body: str):
     #This creates a new synchronized function from the async one
     sync_send_message = async_to_sync(mail.send_message)
     sync_send_message(message)
-    print("Email sent")
\ No newline at end of file
+    print("Email sent")
+
+
+@c_app.task()
+def merge_trending_books():
+    merge_trending_buckets(redis_sync_client)
@@ -0,0 +1,68 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Iterable
+from fastapi import Request, status
+from fastapi.responses import Response
+
+#Conditional GET helpers (ETag / If-None-Match, Last-Modified / If-Modified-Since).
+#Validators are derived from version columns (update_at, reviews_updated_at, ...) so a route can decide on a 304
+#from a cheap column-only select or a cache entry, before it loads and serializes the resource.
+
+
+def make_etag(*parts: Any) -> str:
+    #strong ETag: the same version columns always produce the same representation
+    digest = hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def latest(timestamps: Iterable[datetime | None]) -> datetime | None:
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def as_utc(moment: datetime) -> datetime:
+    #our TIMESTAMP columns are naive local times (datetime.now()), astimezone() reads a naive datetime as local
+    return moment.astimezone(timezone.utc)
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(as_utc(moment), usegmt=True)
+
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime | None = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        #If-None-Match wins over If-Modified-Since when both are sent (RFC 9110 13.2.2)
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        #http dates have a one second resolution
+        return as_utc(last_modified.replace(microsecond=0)) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: datetime | None = None) -> dict:
+    #private: the responses are per user (bearer token), no-cache: clients must revalidate, which is now cheap
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
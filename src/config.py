@@ -18,6 +18,42 @@ class Settings(BaseSettings):
     USE_CREDENTIALS: bool = True
     VALIDATE_CERTS: bool = True
     DOMAIN: str
+    #seconds a serialized BookDetailModel stays in redis, writes invalidate it earlier
+    BOOK_CACHE_TTL: int = 300
+    #answer review submissions with 202 and insert them in batches (src/reviews/ingest.py)
+    REVIEW_WRITE_BEHIND: bool = False
+    REVIEW_BATCH_SIZE: int = 500
+    REVIEW_FLUSH_MS: int = 100
+    #entries pending longer than this (their consumer died) are claimed by another consumer
+    REVIEW_CLAIM_IDLE_MS: int = 60_000
+    #a review delivered more often than this is moved to the dead letter stream (src/reviews/queue.py)
+    REVIEW_MAX_DELIVERIES: int = 10
+    #a book needs this many reviews before it can appear on the top rated leaderboard
+    LEADERBOARD_MIN_REVIEWS: int = 5
+    #trending books: hourly review buckets of the last week, a review loses half its weight every day
+    TRENDING_WINDOW_HOURS: int = 168
+    TRENDING_HALF_LIFE_HOURS: float = 24
+    TRENDING_MERGE_SECONDS: int = 300
+    #seconds an authenticated principal stays cached, in redis and in every worker's memory
+    PRINCIPAL_CACHE_TTL: int = 300
+    PRINCIPAL_LOCAL_TTL: int = 10
+    #verified JWTs kept per worker (src/auth/utils.py decode_token)
+    JWT_CACHE_SIZE: int = 10_000
+    #threads per worker that run bcrypt, i.e. at most this many password hashes/checks at once
+    PASSWORD_HASH_WORKERS: int = 4
+    #bcrypt cost factor, pick it with `python -m src.auth.bcrypt_calibration --target-ms 250`
+    BCRYPT_ROUNDS: int = 12
+    #"<requests>/<second|minute|hour|day>" per route and client (ip, and user when authenticated), see src/ratelimit.py
+    RATE_LIMIT_LOGIN: str = "10/minute"
+    RATE_LIMIT_SIGNUP: str = "5/minute"
+    RATE_LIMIT_PASSWORD_RESET: str = "5/hour"
+    RATE_LIMIT_SEND_MAIL: str = "5/hour"
+    RATE_LIMIT_WRITES: str = "60/minute"
+    #behind a load balancer every request comes from its address, list the proxies (ips or networks, e.g.
+    #'["10.0.0.0/8"]') and the ip bucket uses the right-most X-Forwarded-For address that is not one of them.
+    #Leave it empty when the app is reached directly, or when uvicorn already rewrites the client address
+    #(--proxy-headers --forwarded-allow-ips=...), a forged header must never pick someone else's bucket.
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []
     
     model_config = SettingsConfigDict (
         env_file= ".env",
@@ -29,6 +65,13 @@ Config = Settings()
 broker_url = Config.REDIS_URL
 result_backend = Config.REDIS_URL
 broker_connection_retry_on_startup = True
+#celery -A src.celery_tasks.c_app beat
+beat_schedule = {
+    "merge-trending-books": {
+        "task": "src.celery_tasks.merge_trending_books",
+        "schedule": Config.TRENDING_MERGE_SECONDS,
+    },
+}
 
 
 print(Config)
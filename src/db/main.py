@@ -19,11 +19,15 @@ async def init_db() -> None:
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
+#Built once at import, get_session and code running outside a request (e.g. streaming responses,
+#whose body is sent after request dependencies have already been closed) open their sessions from it.
+async_session_maker = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
+
 async def get_session() -> AsyncSession:
-    Session = sessionmaker(
-        bind=async_engine,
-        class_=AsyncSession,
-        expire_on_commit=False
-    )
-    async with Session() as session:
+    async with async_session_maker() as session:
         yield session
\ No newline at end of file
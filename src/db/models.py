@@ -1,4 +1,4 @@
-from sqlmodel import Field, Relationship, SQLModel, Column
+from sqlmodel import Field, Relationship, SQLModel, Column, Index, CheckConstraint, text
 import sqlalchemy.dialects.postgresql as pg
 from datetime import date, datetime
 import uuid
@@ -6,6 +6,10 @@ from typing import List, Optional
 
 class User(SQLModel, table=True):
     __tablename__ = "users"
+    #emails are unique regardless of case, login and signup look them up through this index
+    __table_args__ = (
+        Index("ux_users_email_lower", text("lower(email)"), unique=True),
+    )
     uid : uuid.UUID = Field(
         sa_column=Column(
             pg.UUID,
@@ -22,6 +26,8 @@ class User(SQLModel, table=True):
     is_verified : bool = Field(default=False)
     #The original password is never stored
     password_hash : str = Field(exclude=True)
+    #embedded in every token issued to the user, incrementing it revokes all of them at once
+    token_generation: int = Field(default=0, exclude=True, sa_column=Column(pg.INTEGER, nullable=False, server_default="0"))
     created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     update_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     books : List["Book"] = Relationship(back_populates="user", sa_relationship_kwargs={'lazy':'selectin'})
@@ -36,6 +42,16 @@ class Book(SQLModel, table=True):
     #The Book model will be in a table automatically named "book"
     #now we changed to name books
     __tablename__ = "books"
+    #keyset pagination indexes, newest first with uid as the tie breaker
+    __table_args__ = (
+        Index("ix_books_created_at_uid", "created_at", "uid"),
+        Index("ix_books_user_uid_created_at_uid", "user_uid", "created_at", "uid"),
+        #pg_trgm indexes for typo tolerant autocomplete
+        Index("ix_books_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+        Index("ix_books_author_trgm", "author", postgresql_using="gin", postgresql_ops={"author": "gin_trgm_ops"}),
+        #one and two character prefixes, a btree range scan in title order (C collation: byte order, no locale)
+        Index("ix_books_title_lower_c", text('lower(title) COLLATE "C"')),
+    )
     uid: uuid.UUID = Field(
         sa_column=Column(
             pg.UUID,
@@ -57,6 +73,19 @@ class Book(SQLModel, table=True):
     language: str
     created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     update_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
+    #rating aggregates, maintained by ReviewService in the same transaction as every review insert/delete.
+    #rating_histogram[0] is the number of 1 star reviews ... rating_histogram[4] the number of 5 star reviews
+    review_count: int = Field(default=0, sa_column=Column(pg.INTEGER, nullable=False, server_default="0"))
+    rating_sum: int = Field(default=0, sa_column=Column(pg.INTEGER, nullable=False, server_default="0"))
+    rating_histogram: List[int] = Field(
+        default_factory=lambda: [0] * 5,
+        sa_column=Column(pg.ARRAY(pg.INTEGER), nullable=False, server_default="{0,0,0,0,0}")
+    )
+    #last time a review of this book was added or removed
+    reviews_updated_at: Optional[datetime] = Field(default=None, sa_column=Column(pg.TIMESTAMP, nullable=True))
+    #books also has a generated search_vector tsvector column (see the add_books_search_vector migration).
+    #It is left unmapped on purpose so loading a Book never pulls it, BookService.search_books queries it directly.
+    #migrations/env.py keeps autogenerate from dropping it.
 
     #repr(object): Return a string containing a printable representation of an object.
     def __repr__(self):
@@ -96,17 +125,49 @@ with Session(engine) as session:
 
 class Review(SQLModel, table=True):
     __tablename__ = "reviews"
+    #per book review pages, newest first or best rated first
+    __table_args__ = (
+        Index("ix_reviews_book_uid_created_at", "book_uid", text("created_at DESC"), text("uid DESC")),
+        Index("ix_reviews_book_uid_rating", "book_uid", text("rating DESC"), text("created_at DESC"), text("uid DESC")),
+        #moderation filters by author, or only by date range
+        Index("ix_reviews_user_uid_created_at", "user_uid", "created_at"),
+        Index("ix_reviews_created_at", "created_at"),
+        #the rating aggregates on books (review_count, rating_sum, rating_histogram) assume 1-5 stars
+        CheckConstraint("rating BETWEEN 1 AND 5", name="ck_reviews_rating_range"),
+    )
     uid: uuid.UUID = Field(
         sa_column=Column(pg.UUID, nullable=False, primary_key=True, default=uuid.uuid4)
     )
-    rating: int = Field(lt=5)
+    rating: int = Field(ge=1, le=5)
     review_text: str = Field(sa_column=Column(pg.VARCHAR, nullable=False))
     user_uid: Optional[uuid.UUID] = Field(default=None, foreign_key="users.uid")
-    book_uid: Optional[uuid.UUID] = Field(default=None, foreign_key="books.uid")
+    book_uid: Optional[uuid.UUID] = Field(default=None, foreign_key="books.uid", ondelete="SET NULL")
     created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     update_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now))
     user: Optional[User] = Relationship(back_populates="reviews")
     book: Optional[Book] = Relationship(back_populates="reviews")
 
     def __repr__(self):
-        return f"<Review for book {self.book_uid} by user {self.user_uid}>"
\ No newline at end of file
+        return f"<Review for book {self.book_uid} by user {self.user_uid}>"
+
+
+class DeletedReview(SQLModel, table=True):
+    """Reviews removed by bulk moderation, kept so a moderation run can be undone.
+
+    Same columns as reviews plus deleted_at. There are no relationships, rows only move between
+    the two tables with INSERT ... SELECT.
+    """
+    __tablename__ = "deleted_reviews"
+    __table_args__ = (
+        Index("ix_deleted_reviews_user_uid_created_at", "user_uid", "created_at"),
+        Index("ix_deleted_reviews_book_uid", "book_uid"),
+        Index("ix_deleted_reviews_created_at", "created_at"),
+    )
+    uid: uuid.UUID = Field(sa_column=Column(pg.UUID, nullable=False, primary_key=True))
+    rating: int
+    review_text: str = Field(sa_column=Column(pg.VARCHAR, nullable=False))
+    user_uid: Optional[uuid.UUID] = Field(default=None, foreign_key="users.uid", ondelete="CASCADE")
+    book_uid: Optional[uuid.UUID] = Field(default=None, foreign_key="books.uid", ondelete="SET NULL")
+    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP))
+    update_at: datetime = Field(sa_column=Column(pg.TIMESTAMP))
+    deleted_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, nullable=False, server_default=text("now()")))
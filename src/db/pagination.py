@@ -0,0 +1,41 @@
+import base64
+import json
+from typing import Any, Callable, Sequence
+from src.errors import InvalidCursor
+
+#Keyset (cursor) pagination helpers.
+#A cursor is the sort key of the last row of a page, e.g. (created_at, uid).
+#It is json encoded and base64url'ed so clients treat it as an opaque string.
+#The next page is then "WHERE (created_at, uid) < (:created_at, :uid)" which an index can seek to directly,
+#so the cost of a page does not grow with how deep the client has scrolled (unlike OFFSET).
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(list(values), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *converters: Callable[[Any], Any]) -> tuple:
+    """Decode a cursor created by encode_cursor, converting every value with the matching converter.
+
+    decode_cursor(cursor, datetime.fromisoformat, uuid.UUID) -> (created_at, uid)
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(converters):
+            raise ValueError("cursor has the wrong number of values")
+        return tuple(convert(value) for convert, value in zip(converters, values))
+    except (ValueError, TypeError):
+        raise InvalidCursor()
+
+
+def next_cursor(rows: Sequence[Any], limit: int, key: Callable[[Any], tuple]) -> str | None:
+    """Pages are fetched with limit + 1 rows. If the extra row exists there is another page
+    and the cursor points at the last row the client actually receives."""
+    if len(rows) <= limit:
+        return None
+    return encode_cursor(*key(rows[limit - 1]))
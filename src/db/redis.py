@@ -1,3 +1,7 @@
+import asyncio
+import heapq
+import logging
+import time
 from redis import asyncio as aioredis
 from src.config import Config
 
@@ -11,19 +15,97 @@ JTI_EXPIRY = 3600
     port = Config.REDIS_PORT,
     db=0
 ) """
-token_blocklist = aioredis.from_url(Config.REDIS_URL)
+#one connection pool per process, shared by the blocklist and the caches built on top of redis
+redis_client = aioredis.from_url(Config.REDIS_URL)
+
+#Revoked jtis are in redis (blocklist:{jti}, expiring after JTI_EXPIRY) and, for the hot path, in every worker's memory.
+#Logouts are rare next to authenticated requests, so every worker keeps the whole set: listen_for_revocations
+#subscribes to REVOCATION_CHANNEL, loads the current blocklist (again after every reconnect) and from then on
+#token_in_blocklist answers from memory. While the listener is not in sync it asks redis, as it always did.
+REVOCATION_CHANNEL = "blocklist:revoked"
+#seconds to wait before resubscribing after the connection dropped
+REVOCATION_RETRY_DELAY = 1
+REVOCATION_PING_INTERVAL = 5
+
+#jti -> time.monotonic() at which its token has expired anyway
+revoked_jtis: dict[str, float] = {}
+#(expires_at, jti) min-heap, expired jtis are popped from the front instead of scanning revoked_jtis
+revocation_expiries: list[tuple[float, str]] = []
+revocations_in_sync = False
+
+
+def blocklist_key(jti : str) -> str:
+    return f"blocklist:{jti}"
+
+
+def remember_revoked_jti(jti : str, ttl : float = JTI_EXPIRY) -> None:
+    now = time.monotonic()
+    revoked_jtis[jti] = now + ttl
+    heapq.heappush(revocation_expiries, (now + ttl, jti))
+    #the set only ever holds the last hour of logouts
+    while revocation_expiries and revocation_expiries[0][0] <= now:
+        expires_at, expired = heapq.heappop(revocation_expiries)
+        #a jti loaded again after a reconnect has a newer entry further back
+        if revoked_jtis.get(expired) == expires_at:
+            del revoked_jtis[expired]
+
 
 async def add_jti_to_blocklist(jti : str) -> None:
-    await token_blocklist.set(
-        name=jti,
-        value="",
-        ex=JTI_EXPIRY
-    )
+    remember_revoked_jti(jti)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(name=blocklist_key(jti), value="", ex=JTI_EXPIRY)
+        pipe.publish(REVOCATION_CHANNEL, jti)
+        await pipe.execute()
 
 async def token_in_blocklist(jti : str) -> bool:
-    token_jti = await token_blocklist.get(jti)
+    if revocations_in_sync:
+        expires_at = revoked_jtis.get(jti)
+        return expires_at is not None and expires_at > time.monotonic()
+    token_jti = await redis_client.get(blocklist_key(jti))
     return token_jti is not None
 
+
+async def load_revoked_jtis() -> None:
+    keys = [key async for key in redis_client.scan_iter(match=blocklist_key("*"), count=1000)]
+    if not keys:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.ttl(key)
+        ttls = await pipe.execute()
+    prefix = len(blocklist_key(""))
+    for key, ttl in zip(keys, ttls):
+        #-2: expired in the meantime
+        if ttl != -2:
+            remember_revoked_jti(key.decode()[prefix:], ttl if ttl > 0 else JTI_EXPIRY)
+
+
+async def listen_for_revocations() -> None:
+    """Keep revoked_jtis in sync with redis, runs for the lifetime of the worker (see src/__init__.py)."""
+    global revocations_in_sync
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            #subscribe first and load afterwards, a logout in between is then seen at least once
+            await pubsub.subscribe(REVOCATION_CHANNEL)
+            await load_revoked_jtis()
+            revocations_in_sync = True
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=REVOCATION_PING_INTERVAL)
+                if message is None:
+                    #a connection that died silently would otherwise look like a quiet channel
+                    await pubsub.ping()
+                elif message["type"] == "message":
+                    remember_revoked_jti(message["data"].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"revocation listener disconnected, checking redis on every request until it is back: {e}")
+        finally:
+            revocations_in_sync = False
+            await pubsub.aclose()
+        await asyncio.sleep(REVOCATION_RETRY_DELAY)
+
 # admin
 [
     "adding users",
@@ -76,6 +76,30 @@ class UserNotFound(BooklyException):
     pass
 
 
+class InvalidCursor(BooklyException):
+    """User has provided a pagination cursor that can not be decoded"""
+
+    pass
+
+
+class RateLimitExceeded(BooklyException):
+    """User has sent more requests to a rate limited route than its limit allows"""
+
+    pass
+
+
+class InvalidFieldSelection(BooklyException):
+    """User has asked for a field that does not exist or can not be selected"""
+
+    pass
+
+
+class ReviewNotFound(BooklyException):
+    """Review Not found"""
+
+    pass
+
+
 class AccountNotVerified(Exception):
     """Account not yet verified"""
     pass
@@ -228,6 +252,53 @@ def register_all_errors(app: FastAPI):
         ),
     )
 
+    app.add_exception_handler(
+        InvalidCursor,
+        create_exception_handler(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            initial_detail={
+                "message": "Pagination cursor is invalid",
+                "resolution": "Use the next_cursor value returned by the previous page",
+                "error_code": "invalid_cursor",
+            },
+        ),
+    )
+
+    app.add_exception_handler(
+        InvalidFieldSelection,
+        create_exception_handler(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            initial_detail={
+                "message": "Unknown field in fields parameter",
+                "resolution": "Use a comma separated list of the resource's field names",
+                "error_code": "invalid_fields",
+            },
+        ),
+    )
+
+    app.add_exception_handler(
+        ReviewNotFound,
+        create_exception_handler(
+            status_code=status.HTTP_404_NOT_FOUND,
+            initial_detail={
+                "message": "Review Not Found",
+                "error_code": "review_not_found",
+            },
+        ),
+    )
+
+    app.add_exception_handler(
+        RateLimitExceeded,
+        create_exception_handler(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            initial_detail={
+                "message": "Too many requests",
+                "resolution": "Wait for the number of seconds in the Retry-After header",
+                "error_code": "rate_limited",
+            },
+        ),
+    )
+
     @app.exception_handler(500)
     async def internal_server_error(request, exc):
 
@@ -0,0 +1,41 @@
+from functools import lru_cache
+from typing import Any, Sequence
+from pydantic import BaseModel, TypeAdapter, create_model
+from src.errors import InvalidFieldSelection
+
+#Sparse fieldsets: ?fields=uid,title,author
+#Only the requested columns are selected (no ORM objects, no relationship loading)
+#and the rows are serialized with a response model built for exactly those fields.
+
+
+def selectable_fields(model: type[BaseModel]) -> list[str]:
+    #excluded fields (e.g. password_hash, rating_sum) are never exposed, computed fields have no column to select
+    return [name for name, field in model.model_fields.items() if not field.exclude]
+
+
+def parse_fields(fields: str | None, model: type[BaseModel]) -> tuple[str, ...] | None:
+    """Turn "uid, title,title" into ("uid", "title"). None means the client wants the full representation."""
+    if fields is None:
+        return None
+    requested = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    allowed = selectable_fields(model)
+    if not requested or any(name not in allowed for name in requested):
+        raise InvalidFieldSelection()
+    return requested
+
+
+@lru_cache(maxsize=512)
+def projection_adapter(model: type[BaseModel], fields: tuple[str, ...]) -> TypeAdapter:
+    #built once per (model, fields) combination, a busy list view asks for the same few combinations over and over
+    projection = create_model(
+        f"{model.__name__}Fields",
+        **{name: (model.model_fields[name].annotation, ...) for name in fields},
+    )
+    return TypeAdapter(list[projection])
+
+
+def project(model: type[BaseModel], fields: tuple[str, ...], rows: Sequence[Any]) -> list[dict]:
+    """Validate column-only rows against the projection of model and dump them json ready."""
+    adapter = projection_adapter(model, fields)
+    items = [{name: row._mapping[name] for name in fields} for row in rows]
+    return adapter.dump_python(adapter.validate_python(items), mode="json")
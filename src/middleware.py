@@ -57,6 +57,13 @@ def register_middleware(app : FastAPI):
         print(message)
 
         return response
+
+    @app.middleware('http')
+    async def rate_limit_headers(request : Request, call_next):
+        #set by the RateLimiter dependency (src/ratelimit.py), also for the 429 it raises
+        response = await call_next(request)
+        response.headers.update(getattr(request.state, "rate_limit_headers", {}))
+        return response
     
     app.add_middleware(
         CORSMiddleware,
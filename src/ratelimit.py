@@ -0,0 +1,169 @@
+import ipaddress
+import logging
+import math
+import time
+from typing import Awaitable, Callable
+from fastapi import Request
+from redis.exceptions import RedisError
+from src.auth.utils import decode_token
+from src.cache import TTLCache
+from src.config import Config
+from src.db.redis import redis_client
+from src.errors import RateLimitExceeded
+
+#Token bucket rate limiting in redis.
+#Every client has a bucket per route, per ip, (when it sends a valid bearer token) per user and optionally per
+#whatever the limiter's key picks from the request (e.g. the email a login is for), each holding up to
+#limit tokens that refill at limit / period per second. A request takes one token from each of its buckets
+#or is rejected with 429 if any of them is empty. The check and the update are one Lua script, so concurrent
+#requests of the same client never both take the last token.
+#Responses carry RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset (and Retry-After on a 429),
+#they are attached by the rate_limit_headers middleware (src/middleware.py).
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        allowed = 0
+    end
+end
+local remaining = capacity
+for i, key in ipairs(KEYS) do
+    local tokens = levels[i]
+    if allowed == 1 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+    remaining = math.min(remaining, tokens)
+end
+return {allowed, tostring(remaining)}
+"""
+token_bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+#bucket keys -> True while a client is known to be out of tokens, requests are then rejected without asking redis
+local_blocks = TTLCache(maxsize=10_000, ttl=1)
+
+trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in Config.RATE_LIMIT_TRUSTED_PROXIES]
+
+
+def is_trusted_proxy(host : str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+
+def client_ip(request : Request) -> str:
+    """The address the ip bucket is keyed on, see Config.RATE_LIMIT_TRUSTED_PROXIES."""
+    host = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(host):
+        return host
+    #every proxy appends the address it got the request from, entries left of the first untrusted one
+    #were written by the client and can say anything
+    forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+    for address in reversed(forwarded):
+        if not is_trusted_proxy(address):
+            return address
+    return forwarded[0] if forwarded else host
+
+
+def parse_rate(rate : str) -> tuple[int, int]:
+    """"10/minute" -> (10, 60)"""
+    limit, _, period = rate.partition("/")
+    if not limit.strip().isdigit() or int(limit) < 1 or period.strip() not in PERIODS:
+        raise ValueError(f"invalid rate limit {rate!r}, expected e.g. '10/minute'")
+    return int(limit), PERIODS[period.strip()]
+
+
+async def submitted_email(request : Request) -> str | None:
+    """Bucket on the email in the json body, so attempts against one account are limited whatever ip they come from."""
+    #FastAPI has already read the body, request.json() parses the cached bytes
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    email = body.get("email") if isinstance(body, dict) else None
+    if not isinstance(email, str) or not email.strip():
+        return None
+    return f"email:{email.strip().lower()}"
+
+
+class RateLimiter:
+    """Dependency limiting a route to rate requests per client, e.g. Depends(RateLimiter(Config.RATE_LIMIT_LOGIN)).
+
+    key adds one more bucket for whatever it returns for the request (nothing when it returns None),
+    e.g. RateLimiter(Config.RATE_LIMIT_LOGIN, key=submitted_email).
+    Buckets are per route, unless scope names buckets shared by every route the limiter is used on.
+    Without redis the limit is not enforced, an outage must not lock everybody out.
+    """
+
+    def __init__(self, rate : str, key : Callable[[Request], Awaitable[str | None]] | None = None,
+                 scope : str | None = None) -> None:
+        self.limit, self.period = parse_rate(rate)
+        self.refill_rate = self.limit / self.period
+        self.key = key
+        self.scope = scope
+
+    async def bucket_keys(self, request : Request) -> list[str]:
+        if self.scope:
+            prefix = f"ratelimit:{self.scope}"
+        else:
+            route = request.scope.get("route")
+            path = route.path if route else request.url.path
+            prefix = f"ratelimit:{request.method}:{path}"
+        keys = [f"{prefix}:ip:{client_ip(request)}"]
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            #decode_token is cached, this costs no signature check for a token the client already used.
+            #An invalid token is logged once, by TokenBearer
+            token_data = decode_token(token, log_failures=False)
+            if token_data:
+                keys.append(f"{prefix}:user:{token_data['user']['user_uid']}")
+        if self.key is not None:
+            extra = await self.key(request)
+            if extra:
+                keys.append(f"{prefix}:{extra}")
+        return keys
+
+    def headers(self, remaining : float) -> dict:
+        #seconds until the bucket is full again
+        reset = math.ceil((self.limit - remaining) / self.refill_rate)
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(max(0, math.floor(remaining))),
+            "RateLimit-Reset": str(reset),
+        }
+        if remaining < 1:
+            headers["Retry-After"] = str(math.ceil((1 - remaining) / self.refill_rate))
+        return headers
+
+    async def __call__(self, request : Request) -> None:
+        keys = await self.bucket_keys(request)
+        if tuple(keys) in local_blocks:
+            request.state.rate_limit_headers = self.headers(0)
+            raise RateLimitExceeded()
+        try:
+            allowed, remaining = await token_bucket(keys=keys, args=[self.limit, self.refill_rate])
+        except RedisError as e:
+            logging.warning(f"rate limiter unavailable, request let through: {e}")
+            return
+        remaining = float(remaining)
+        request.state.rate_limit_headers = self.headers(remaining)
+        if not allowed:
+            #the bucket is empty for at least this long, until then this worker answers on its own
+            local_blocks.set(tuple(keys), True, ttl=(1 - remaining) / self.refill_rate)
+            raise RateLimitExceeded()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import socket
+from redis.exceptions import RedisError
+from src.config import Config
+from src.db.main import async_session_maker
+from src.reviews.queue import (
+    create_consumer_group, read_reviews, acknowledge_reviews, claim_stale_reviews, delivery_counts, dead_letter_reviews
+)
+from src.reviews.service import ReviewService
+
+review_service = ReviewService()
+
+#seconds to wait before retrying after redis or postgres failed, doubled after every failure in a row
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+class ReviewIngestConsumer:
+    """Drains the review stream into postgres.
+
+    A batch is flushed when it holds REVIEW_BATCH_SIZE reviews or REVIEW_FLUSH_MS after its first review arrived,
+    whichever comes first. Every batch is one multi-row INSERT, one aggregate UPDATE per book, one commit
+    and one cache invalidation. Entries are acknowledged only after the commit, so the reviews of a worker
+    that died mid batch stay pending until a consumer claims them after REVIEW_CLAIM_IDLE_MS and inserts them
+    (deduplicated by uid).
+
+    After a failed flush the pending entries are retried one at a time, so a review that can not be inserted only
+    holds up itself, and once it has been delivered REVIEW_MAX_DELIVERIES times it goes to the dead letter stream.
+    """
+
+    def __init__(self, batch_size : int = Config.REVIEW_BATCH_SIZE, flush_ms : int = Config.REVIEW_FLUSH_MS,
+                 name : str | None = None) -> None:
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        #a restarted worker gets a new name, its old entries are picked up by claim_stale_reviews
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self._recovering = True
+        #retry pending entries one by one until they are drained
+        self._isolating = False
+        self._failures = 0
+        self._next_claim = 0.0
+
+    async def run(self) -> None:
+        await create_consumer_group()
+        while True:
+            try:
+                entries = await self.next_batch()
+                if entries:
+                    await self.flush(entries)
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = min(RETRY_DELAY * 2 ** self._failures, MAX_RETRY_DELAY)
+                self._failures += 1
+                logging.exception(f"review ingestion failed, retrying in {delay}s: {e}")
+                self._recovering = True
+                self._isolating = True
+                await asyncio.sleep(delay)
+
+    async def next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        if loop.time() >= self._next_claim:
+            self._next_claim = loop.time() + Config.REVIEW_CLAIM_IDLE_MS / 1000
+            if await claim_stale_reviews(self.name, Config.REVIEW_CLAIM_IDLE_MS):
+                self._recovering = True
+
+        while self._recovering:
+            entries = await read_reviews(self.name, "0", 1 if self._isolating else self.batch_size)
+            if not entries:
+                self._recovering = False
+                self._isolating = False
+                break
+            entries = await self.dead_letter_exhausted(entries)
+            if entries:
+                return entries
+
+        entries = await read_reviews(self.name, ">", self.batch_size, block=self.flush_ms)
+        deadline = loop.time() + self.flush_ms / 1000
+        while entries and len(entries) < self.batch_size:
+            remaining = int((deadline - loop.time()) * 1000)
+            if remaining <= 0:
+                break
+            more = await read_reviews(self.name, ">", self.batch_size - len(entries), block=remaining)
+            if not more:
+                break
+            entries.extend(more)
+        return entries
+
+    async def flush(self, entries : list) -> None:
+        async with async_session_maker() as session:
+            await review_service.add_reviews_batch([review for _, review in entries], session)
+        try:
+            await acknowledge_reviews(entries)
+        except RedisError as e:
+            #the batch is committed, if it is read again ON CONFLICT skips it
+            logging.warning(f"could not acknowledge review batch: {e}")
+            self._recovering = True
+
+    async def dead_letter_exhausted(self, entries : list) -> list:
+        counts = await delivery_counts(self.name, [entry_id for entry_id, _ in entries])
+        exhausted = [entry for entry in entries if counts.get(entry[0], 0) > Config.REVIEW_MAX_DELIVERIES]
+        if exhausted:
+            logging.error(f"moving {len(exhausted)} reviews to the dead letter stream: "
+                          f"{[str(review.uid) for _, review in exhausted]}")
+            await dead_letter_reviews(exhausted)
+        return [entry for entry in entries if counts.get(entry[0], 0) <= Config.REVIEW_MAX_DELIVERIES]
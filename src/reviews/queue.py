@@ -0,0 +1,134 @@
+import logging
+from redis.exceptions import RedisError, ResponseError
+from src.db.redis import redis_client
+from src.reviews.schemas import ReviewModel
+
+#Write-behind review ingestion (Config.REVIEW_WRITE_BEHIND).
+#A submitted review is validated, given its uid and appended to a redis stream, the request is answered with 202
+#and ReviewIngestConsumer (src/reviews/ingest.py) inserts the stream entries in batches.
+#Until its batch is committed a review is also kept in a per user hash, so the user who wrote it
+#can read it back right away (read-your-writes), everybody else sees it once it is in postgres.
+
+REVIEW_STREAM = "reviews:ingest"
+REVIEW_CONSUMER_GROUP = "review-writers"
+#reviews that could not be inserted after Config.REVIEW_MAX_DELIVERIES attempts, kept for inspection and replay
+REVIEW_DEAD_LETTER_STREAM = "reviews:dead"
+#a pending entry outlives any sane flush interval, it only matters if the consumers are down
+PENDING_REVIEW_TTL = 3600
+
+
+def pending_reviews_key(user_uid) -> str:
+    return f"reviews:pending:{user_uid}"
+
+
+async def enqueue_review(review : ReviewModel) -> None:
+    payload = review.model_dump_json()
+    key = pending_reviews_key(review.user_uid)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.xadd(REVIEW_STREAM, {"review": payload})
+        pipe.hset(key, str(review.uid), payload)
+        pipe.expire(key, PENDING_REVIEW_TTL)
+        await pipe.execute()
+
+
+#reads of pending reviews are best effort, without redis the user just sees what is in postgres
+async def get_pending_review(user_uid, review_uid) -> ReviewModel | None:
+    try:
+        payload = await redis_client.hget(pending_reviews_key(user_uid), str(review_uid))
+    except RedisError as e:
+        logging.warning(f"pending review read failed: {e}")
+        return None
+    return ReviewModel.model_validate_json(payload) if payload else None
+
+
+async def get_pending_reviews(user_uid, book_uid=None) -> list[ReviewModel]:
+    """The user's reviews that are not in postgres yet, newest first."""
+    try:
+        payloads = await redis_client.hvals(pending_reviews_key(user_uid))
+    except RedisError as e:
+        logging.warning(f"pending review read failed: {e}")
+        return []
+    reviews = [ReviewModel.model_validate_json(payload) for payload in payloads]
+    if book_uid is not None:
+        reviews = [review for review in reviews if str(review.book_uid) == str(book_uid)]
+    return sorted(reviews, key=lambda review: review.created_at, reverse=True)
+
+
+async def create_consumer_group() -> None:
+    try:
+        await redis_client.xgroup_create(REVIEW_STREAM, REVIEW_CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        #BUSYGROUP: another worker created it first
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def read_reviews(consumer : str, last_id : str, count : int, block : int | None = None) -> list[tuple[bytes, ReviewModel]]:
+    """Read up to count entries for consumer. last_id ">" means new entries,
+    "0" the entries delivered to this consumer earlier but never acknowledged."""
+    response = await redis_client.xreadgroup(
+        REVIEW_CONSUMER_GROUP, consumer, {REVIEW_STREAM: last_id}, count=count, block=block
+    )
+    if not response:
+        return []
+    _, entries = response[0]
+    #an entry deleted while it was pending comes back without fields, there is nothing left to insert
+    deleted = [entry_id for entry_id, fields in entries if not fields]
+    if deleted:
+        await redis_client.xack(REVIEW_STREAM, REVIEW_CONSUMER_GROUP, *deleted)
+    return [
+        (entry_id, ReviewModel.model_validate_json(fields[b"review"]))
+        for entry_id, fields in entries
+        if fields
+    ]
+
+
+async def claim_stale_reviews(consumer : str, min_idle_ms : int) -> int:
+    """Move the entries that have been pending for min_idle_ms to consumer, e.g. those of a worker that died
+    mid batch and came back under another name. Returns how many were claimed, consumer reads them with last_id "0"."""
+    claimed = 0
+    start_id = "0-0"
+    while True:
+        #not JUSTID, redis-py drops the cursor from that reply. Claiming counts as a delivery
+        start_id, entries, *_ = await redis_client.xautoclaim(
+            REVIEW_STREAM, REVIEW_CONSUMER_GROUP, consumer, min_idle_ms, start_id=start_id, count=100
+        )
+        claimed += len(entries)
+        if start_id in (b"0-0", "0-0"):
+            return claimed
+
+
+async def delivery_counts(consumer : str, entry_ids : list[bytes]) -> dict[bytes, int]:
+    """How often each of consumer's pending entries has been delivered."""
+    pending = await redis_client.xpending_range(
+        REVIEW_STREAM, REVIEW_CONSUMER_GROUP, min=min(entry_ids), max=max(entry_ids), count=len(entry_ids),
+        consumername=consumer
+    )
+    return {entry["message_id"]: entry["times_delivered"] for entry in pending}
+
+
+async def acknowledge_reviews(entries : list[tuple[bytes, ReviewModel]]) -> None:
+    """Drop a flushed batch from the stream and from the pending hashes of its authors."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        _acknowledge(pipe, entries)
+        await pipe.execute()
+
+
+def _acknowledge(pipe, entries : list[tuple[bytes, ReviewModel]]) -> None:
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pending = {}
+    for _, review in entries:
+        pending.setdefault(pending_reviews_key(review.user_uid), []).append(str(review.uid))
+    pipe.xack(REVIEW_STREAM, REVIEW_CONSUMER_GROUP, *entry_ids)
+    pipe.xdel(REVIEW_STREAM, *entry_ids)
+    for key, review_uids in pending.items():
+        pipe.hdel(key, *review_uids)
+
+
+async def dead_letter_reviews(entries : list[tuple[bytes, ReviewModel]]) -> None:
+    """Move reviews that keep failing to REVIEW_DEAD_LETTER_STREAM so they stop blocking the ones behind them."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for entry_id, review in entries:
+            pipe.xadd(REVIEW_DEAD_LETTER_STREAM, {"review": review.model_dump_json(), "entry_id": entry_id})
+        _acknowledge(pipe, entries)
+        await pipe.execute()
@@ -1,55 +1,113 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, status, Query, Request, Response
+from fastapi.responses import JSONResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
-from src.auth.dependencies import RoleChecker, get_current_user
+from src.auth.dependencies import RoleChecker, AccessTokenDetails, CurrentPrincipal
 from src.db.main import get_session
-from src.db.models import User
-from .schemas import ReviewCreateModel
+from src.config import Config
+from src.ratelimit import RateLimiter
+from src.errors import ReviewNotFound
+from src.fields import parse_fields, project
+from src.conditional import make_etag, has_conditional_headers, is_not_modified, validator_headers, not_modified
+from .schemas import ReviewCreateModel, ReviewModel, ReviewModerationFilter, ReviewModerationResultModel
 from .service import ReviewService
+from .queue import get_pending_review
+import uuid
 
 review_service = ReviewService()
 
 MyAsyncSession = Annotated[AsyncSession, Depends(get_session)]
-CurrentUser = Annotated[User, Depends(get_current_user)]
+#?fields=uid,rating returns only those fields, read from a column-only select
+Fields = Annotated[str | None, Query(description="Comma separated list of fields to return")]
 
 admin_role_checker = Depends(RoleChecker(["admin"]))
 user_role_checker = Depends(RoleChecker(["user", "admin"]))
+write_rate_limit = Depends(RateLimiter(Config.RATE_LIMIT_WRITES))
 
 review_router = APIRouter()
 
+REVIEW_VERSION_FIELDS = ("uid", "update_at")
+
+
+def review_validators(review) -> tuple:
+    return make_etag(review.uid, review.update_at), review.update_at
+
 @review_router.get("/", dependencies=[admin_role_checker])
-async def get_all_reviews(session: MyAsyncSession):
-    books = await review_service.get_all_reviews(session)
+async def get_all_reviews(session: MyAsyncSession, fields: Fields = None):
+    selected = parse_fields(fields, ReviewModel)
+    reviews = await review_service.get_all_reviews(session, selected)
 
-    return books
+    if selected is not None:
+        return JSONResponse(content=project(ReviewModel, selected, reviews))
+    return reviews
 
 
 @review_router.get("/{review_uid}", dependencies=[user_role_checker])
-async def get_review(review_uid: str, session: MyAsyncSession):
-    book = await review_service.get_review(review_uid, session)
+async def get_review(review_uid: uuid.UUID, request: Request, response: Response, session: MyAsyncSession,
+                     token_details: AccessTokenDetails, fields: Fields = None):
+    selected = parse_fields(fields, ReviewModel)
+    if selected is None and has_conditional_headers(request):
+        version = await review_service.get_review(review_uid, session, REVIEW_VERSION_FIELDS)
+        if not version:
+            raise ReviewNotFound()
+        etag, last_modified = review_validators(version)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(validator_headers(etag, last_modified))
+
+    review = await review_service.get_review(review_uid, session, selected)
 
-    if not book:
-        raise
+    if not review and Config.REVIEW_WRITE_BEHIND:
+        #read-your-writes: the author sees a queued review before its batch is flushed
+        pending = await get_pending_review(token_details["user"]["user_uid"], review_uid)
+        if pending:
+            content = pending.model_dump(mode="json", include=set(selected) if selected else None)
+            return JSONResponse(content=content, headers={"Cache-Control": "private, no-store"})
+    if not review:
+        raise ReviewNotFound()
+    if selected is not None:
+        return JSONResponse(content=project(ReviewModel, selected, [review])[0])
+    response.headers.update(validator_headers(*review_validators(review)))
+    return review
 
-@review_router.post('/book/{book_uid}', dependencies=[user_role_checker])
-async def add_review_to_books(book_uid : str, review_data : ReviewCreateModel,
-                              user : CurrentUser , session : MyAsyncSession):
-    new_review = await review_service.add_review_to_book(user.email,review_data,book_uid,session)
+@review_router.post('/book/{book_uid}', dependencies=[write_rate_limit, user_role_checker])
+async def add_review_to_books(book_uid : uuid.UUID, review_data : ReviewCreateModel,
+                              token_details : AccessTokenDetails , session : MyAsyncSession):
+    user_uid = token_details["user"]["user_uid"]
+    if Config.REVIEW_WRITE_BEHIND:
+        queued_review = await review_service.enqueue_review(user_uid, review_data, book_uid, session)
+        if queued_review is not None:
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=queued_review.model_dump(mode="json"),
+                headers={"Location": f"/api/v1/reviews/{queued_review.uid}"},
+            )
+    new_review = await review_service.add_review_to_book(user_uid,review_data,book_uid,session)
     return new_review
 
 
+#bulk moderation, e.g. {"user_uid": "<spammer>"} or {"book_uid": "...", "created_after": "2026-10-01T00:00:00"}
+@review_router.post("/moderation/delete", response_model=ReviewModerationResultModel, dependencies=[admin_role_checker])
+async def delete_reviews(filters : ReviewModerationFilter, session : MyAsyncSession):
+    return await review_service.delete_reviews(filters, session)
+
+
+@review_router.post("/moderation/restore", response_model=ReviewModerationResultModel, dependencies=[admin_role_checker])
+async def restore_reviews(filters : ReviewModerationFilter, session : MyAsyncSession):
+    return await review_service.restore_reviews(filters, session)
+
+
 @review_router.delete(
     "/{review_uid}",
-    dependencies=[user_role_checker],
+    dependencies=[write_rate_limit, user_role_checker],
     status_code=status.HTTP_204_NO_CONTENT,
 )
 async def delete_review(
-    review_uid: str,
-    current_user: CurrentUser,
+    review_uid: uuid.UUID,
+    current_user: CurrentPrincipal,
     session: MyAsyncSession,
 ):
     await review_service.delete_review_to_from_book(
-        review_uid=review_uid, user_email=current_user.email, session=session
+        review_uid=review_uid, user_uid=current_user.uid, session=session
     )
 
     return None
\ No newline at end of file
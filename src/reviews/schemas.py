@@ -1,11 +1,11 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 import uuid
 from datetime import datetime, date
-from typing import Optional
+from typing import Optional, List
 
 class ReviewModel(BaseModel):
     uid : uuid.UUID
-    rating: int = Field(lt=5)
+    rating: int = Field(ge=1, le=5)
     review_text : str
     #user_uid : Optional[uuid.UUID]
     user_uid: uuid.UUID | None
@@ -13,6 +13,32 @@ class ReviewModel(BaseModel):
     created_at : datetime
     update_at : datetime
 
+class ReviewPageModel(BaseModel):
+    items: List[ReviewModel]
+    #pass it back as ?cursor= to get the next page, None means this is the last page
+    next_cursor: Optional[str] = None
+
 class ReviewCreateModel(BaseModel):
-    rating : int
-    review_text : str
\ No newline at end of file
+    rating : int = Field(ge=1, le=5)
+    review_text : str
+
+
+class ReviewModerationFilter(BaseModel):
+    """Selects the reviews of a bulk moderation run, every given criterion has to match."""
+    uids : Optional[List[uuid.UUID]] = Field(default=None, max_length=10_000)
+    user_uid : Optional[uuid.UUID] = None
+    book_uid : Optional[uuid.UUID] = None
+    created_after : Optional[datetime] = None
+    created_before : Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        #an empty filter would match every review
+        if not (self.uids or self.user_uid or self.book_uid or self.created_after or self.created_before):
+            raise ValueError("at least one filter is required")
+        return self
+
+
+class ReviewModerationResultModel(BaseModel):
+    count : int
+    book_uids : List[uuid.UUID]
@@ -1,73 +1,319 @@
 from fastapi.exceptions import HTTPException
 from fastapi import status
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlmodel import select, desc
-from src.db.models import Review
-from src.auth.service import UserService
-from src.books.service import BookService
+from sqlmodel import select, desc, update, delete, insert, func, tuple_
+from sqlalchemy import any_, bindparam, true
+from sqlalchemy.orm import aliased
+import sqlalchemy.dialects.postgresql as pg
+from src.db.models import Review, Book, User, DeletedReview
+from src.books.cache import invalidate_book_detail
+from src.books.leaderboards import update_leaderboards
+from src.books.trending import record_review_activity
+from src.errors import BookNotFound, UserNotFound
+from sqlalchemy.exc import IntegrityError
+from src.db.pagination import DEFAULT_PAGE_SIZE, decode_cursor, next_cursor
 from datetime import datetime
-from src.reviews.schemas import ReviewCreateModel
+from src.reviews.schemas import ReviewCreateModel, ReviewModel, ReviewModerationFilter
+from src.reviews.queue import enqueue_review
+from redis.exceptions import RedisError
+import logging
+import uuid
 
-book_service = BookService()
-user_service = UserService()
+#reviews moved per statement (and transaction) by bulk moderation
+MODERATION_CHUNK_SIZE = 5000
+
+#sort name -> keyset columns (all descending), served by the ix_reviews_book_uid_* indexes
+REVIEW_SORT_KEYS = {
+    "newest": (Review.created_at, Review.uid),
+    "rating": (Review.rating, Review.created_at, Review.uid),
+}
+REVIEW_CURSOR_CONVERTERS = {
+    "newest": (datetime.fromisoformat, uuid.UUID),
+    "rating": (int, datetime.fromisoformat, uuid.UUID),
+}
 
 class ReviewService:
-    async def add_review_to_book(self, user_email : str, review_data : ReviewCreateModel , book_uid : str, session : AsyncSession):
+    async def add_review_to_book(self, user_uid : str, review_data : ReviewCreateModel , book_uid : str, session : AsyncSession):
+        """Insert a review without loading the book, the user or any of their collections.
+
+        The rating aggregate UPDATE doubles as the book existence check (no row returned -> no book)
+        and the user is checked by the reviews.user_uid foreign key, so the cost of a write does not
+        depend on how many reviews the book or the user already have.
+        """
+        new_review = Review(**review_data.model_dump(), user_uid=user_uid, book_uid=book_uid)
+
+        stats = await self.apply_rating_changes(book_uid, [new_review.rating], session)
+        if stats is None:
+            await session.rollback()
+            raise BookNotFound()
+
+        session.add(new_review)
         try:
-            book = await book_service.get_book(book_uid,session)
-            if not book:
-                raise HTTPException(
-                    detail="Book not found", status_code=status.HTTP_404_NOT_FOUND
-                )
-            user = await user_service.get_user_by_email(user_email,session)
-            if not user:
-                raise HTTPException(
-                    detail="User not found", status_code=status.HTTP_404_NOT_FOUND
-                )
-            review_data_dict = review_data.model_dump()
-
-            #SQLModel will automatically set the user_uid and book_uid fields based on the user and book objects you provide.
-            #Relationships between the User and Book objects need to be properly set up in the database 
-            #For the automatic assignment of user_uid and book_uid in the Review model to work.
-            new_review = Review(**review_data_dict, user=user, book = book)
-
-            session.add(new_review)
+            #flushes the INSERT, it commits together with the aggregate update
             await session.commit()
-            return new_review
-        
-        except Exception as e:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail="Ooops... Something went wrong")
-        
+        except IntegrityError:
+            await session.rollback()
+            raise UserNotFound()
+        await invalidate_book_detail(book_uid)
+        await update_leaderboards(stats)
+        await record_review_activity({book_uid: 1})
+        return new_review
+
+    async def enqueue_review(self, user_uid : str, review_data : ReviewCreateModel, book_uid : str, session : AsyncSession) -> ReviewModel | None:
+        """Write-behind variant of add_review_to_book, the review is inserted later by ReviewIngestConsumer.
+
+        The book is checked with a primary key lookup so an unknown book is still a 404 and not a 202.
+        Returns None when redis is not reachable, the caller then writes the review synchronously.
+        """
+        result = await session.exec(select(Book.uid).where(Book.uid == book_uid))
+        if result.first() is None:
+            raise BookNotFound()
+
+        now = datetime.now()
+        review = ReviewModel(
+            **review_data.model_dump(), uid=uuid.uuid4(), user_uid=user_uid, book_uid=book_uid, created_at=now, update_at=now
+        )
+        try:
+            await enqueue_review(review)
+        except RedisError as e:
+            logging.warning(f"review queue unavailable, writing synchronously: {e}")
+            return None
+        return review
+
+    async def add_reviews_batch(self, reviews : list[ReviewModel], session : AsyncSession) -> list:
+        """Insert a batch of queued reviews in one transaction and return the uids of the books they touched,
+        the caches of those books are invalidated once for the whole batch.
+
+        Reviews whose book or user was deleted after they were queued are dropped, and a review that is
+        already in the table (the batch was redelivered after a crash) is skipped by ON CONFLICT, only the
+        rows that were actually inserted count towards the rating aggregates.
+        """
+        book_uids = await self._existing_uids(Book, {review.book_uid for review in reviews}, session)
+        user_uids = await self._existing_uids(User, {review.user_uid for review in reviews}, session)
+        rows = [
+            review.model_dump()
+            for review in reviews
+            if review.book_uid in book_uids and review.user_uid in user_uids
+        ]
+        if not rows:
+            return []
 
-    async def get_review(self, review_uid: str, session: AsyncSession):
-        statement = select(Review).where(Review.uid == review_uid)
+        statement = (
+            pg.insert(Review)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[Review.uid])
+            .returning(Review.book_uid, Review.rating)
+        )
+        result = await session.execute(statement)
+        ratings_by_book = {}
+        for book_uid, rating in result.all():
+            ratings_by_book.setdefault(book_uid, []).append(rating)
+        #one aggregate UPDATE per book, always in the same order so two batches can not deadlock on the book rows
+        stats = [
+            await self.apply_rating_changes(book_uid, ratings_by_book[book_uid], session)
+            for book_uid in sorted(ratings_by_book, key=str)
+        ]
+        await session.commit()
+        await invalidate_book_detail(*ratings_by_book)
+        await update_leaderboards(*stats)
+        await record_review_activity({book_uid: len(ratings) for book_uid, ratings in ratings_by_book.items()})
+        return list(ratings_by_book)
+
+    async def _existing_uids(self, model, uids : set, session : AsyncSession) -> set:
+        statement = select(model.uid).where(
+            model.uid == any_(bindparam("uids", list(uids), type_=pg.ARRAY(pg.UUID(as_uuid=True))))
+        )
+        result = await session.exec(statement)
+        return set(result.all())
+
+
+    async def apply_rating_changes(self, book_uid, ratings : list[int], session : AsyncSession, removed : bool = False):
+        """Add (or remove) ratings to the book's review_count / rating_sum / rating_histogram.
+
+        One UPDATE relative to the current values, so concurrent reviews of the same book never lose an increment.
+        It does not commit, callers run it in the transaction that inserts or deletes the reviews.
+        Returns the new aggregates or None when the book does not exist.
+        """
+        if book_uid is None or not ratings:
+            return None
+        sign = -1 if removed else 1
+        stars = [ratings.count(star) for star in range(1, 6)]
+        statement = (
+            update(Book)
+            .where(Book.uid == book_uid)
+            .values(
+                review_count=Book.review_count + sign * len(ratings),
+                rating_sum=Book.rating_sum + sign * sum(ratings),
+                #postgres arrays are 1-indexed, Book.rating_histogram[1] is the 1 star count
+                rating_histogram=pg.array(
+                    [Book.rating_histogram[star] + sign * stars[star - 1] for star in range(1, 6)]
+                ),
+                reviews_updated_at=datetime.now(),
+            )
+            .returning(Book.uid, Book.review_count, Book.rating_sum, Book.language)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(statement)
+        return result.first()
+
+    def _select_reviews(self, fields: tuple[str, ...] | None = None, extra_columns: tuple[str, ...] = ()):
+        #a sparse fieldset selects only those columns and skips the ORM entirely
+        if fields is None:
+            return select(Review)
+        names = dict.fromkeys((*fields, *extra_columns))
+        return select(*[Review.__table__.c[name] for name in names])
+
+    async def get_book_reviews(self, book_uid: str, session: AsyncSession, limit: int = DEFAULT_PAGE_SIZE,
+                               cursor: str | None = None, sort: str = "newest", fields: tuple[str, ...] | None = None) -> dict:
+        keys = REVIEW_SORT_KEYS[sort]
+        statement = self._select_reviews(fields, extra_columns=tuple(key.key for key in keys))
+        statement = statement.where(Review.book_uid == book_uid)
+        if cursor:
+            #a cursor of the other sort order has a different length and is rejected as invalid
+            statement = statement.where(tuple_(*keys) < decode_cursor(cursor, *REVIEW_CURSOR_CONVERTERS[sort]))
+        statement = statement.order_by(*[key.desc() for key in keys]).limit(limit + 1)
+        result = await session.exec(statement)
+        reviews = result.all()
+        return {
+            "items": reviews[:limit],
+            "next_cursor": next_cursor(reviews, limit, key=lambda review: tuple(getattr(review, key.key) for key in keys)),
+        }
+
+    async def get_first_review_pages(self, book_uids: list, session: AsyncSession, limit: int = DEFAULT_PAGE_SIZE) -> dict:
+        """The newest page of reviews of every book in book_uids, in a single query.
+
+        Every book is a LATERAL subquery with its own LIMIT limit + 1, so ix_reviews_book_uid_created_at
+        is seeked once per book and only those rows are read, however many reviews the popular ones have.
+        """
+        requested = (
+            func.unnest(bindparam("book_uids", book_uids, type_=pg.ARRAY(pg.UUID(as_uuid=True))))
+            .table_valued("book_uid")
+            .render_derived(name="requested")
+        )
+        newest = (
+            select(Review)
+            .where(Review.book_uid == requested.c.book_uid)
+            .order_by(Review.created_at.desc(), Review.uid.desc())
+            .limit(limit + 1)
+            .lateral("newest")
+        )
+        newest_review = aliased(Review, newest)
+        statement = (
+            select(newest_review)
+            .select_from(requested)
+            .join(newest, true())
+            .order_by(newest.c.book_uid, newest.c.created_at.desc(), newest.c.uid.desc())
+        )
+        result = await session.exec(statement)
+        reviews_by_book = {book_uid: [] for book_uid in book_uids}
+        for review in result.all():
+            reviews_by_book[review.book_uid].append(review)
+        return {
+            book_uid: {
+                "items": reviews[:limit],
+                "next_cursor": next_cursor(reviews, limit, key=lambda review: (review.created_at, review.uid)),
+            }
+            for book_uid, reviews in reviews_by_book.items()
+        }
+
+    async def get_review(self, review_uid: str, session: AsyncSession, fields: tuple[str, ...] | None = None):
+        statement = self._select_reviews(fields).where(Review.uid == review_uid)
 
         result = await session.exec(statement)
 
         return result.first()
     
-    async def get_all_reviews(self, session: AsyncSession):
-        statement = select(Review).order_by(desc(Review.created_at))
+    async def get_all_reviews(self, session: AsyncSession, fields: tuple[str, ...] | None = None):
+        statement = self._select_reviews(fields).order_by(desc(Review.created_at))
 
         result = await session.exec(statement)
 
         return result.all()
     
 
+    async def delete_reviews(self, filters : ReviewModerationFilter, session : AsyncSession,
+                             chunk_size : int = MODERATION_CHUNK_SIZE) -> dict:
+        """Bulk moderation: move every review matching filters to deleted_reviews."""
+        return await self._move_reviews(Review, DeletedReview, filters, session, chunk_size, removed=True)
+
+    async def restore_reviews(self, filters : ReviewModerationFilter, session : AsyncSession,
+                              chunk_size : int = MODERATION_CHUNK_SIZE) -> dict:
+        """Undo delete_reviews for the archived reviews matching filters."""
+        return await self._move_reviews(DeletedReview, Review, filters, session, chunk_size, removed=False)
+
+    async def _move_reviews(self, source, target, filters : ReviewModerationFilter, session : AsyncSession,
+                            chunk_size : int, removed : bool) -> dict:
+        """Move matching rows from source to target, chunk_size rows per statement and transaction.
+
+        Every chunk is a single "WITH moved AS (DELETE ... RETURNING ...) INSERT INTO target SELECT ... FROM moved",
+        followed by one aggregate UPDATE per affected book, a commit, and one cache/leaderboard update for the
+        chunk. Short transactions keep the locks on popular books brief even when a spammer has millions of reviews.
+        """
+        criteria = []
+        if filters.uids:
+            criteria.append(source.uid == any_(bindparam("uids", filters.uids, type_=pg.ARRAY(pg.UUID(as_uuid=True)))))
+        if filters.user_uid:
+            criteria.append(source.user_uid == filters.user_uid)
+        if filters.book_uid:
+            criteria.append(source.book_uid == filters.book_uid)
+        if filters.created_after:
+            criteria.append(source.created_at >= filters.created_after)
+        if filters.created_before:
+            criteria.append(source.created_at < filters.created_before)
+
+        columns = list(Review.__table__.columns.keys())
+        count = 0
+        book_uids = set()
+        while True:
+            chunk = select(source.uid).where(*criteria).limit(chunk_size)
+            moved = (
+                delete(source)
+                .where(source.uid.in_(chunk))
+                .returning(*[source.__table__.c[name] for name in columns])
+                .cte("moved")
+            )
+            statement = (
+                insert(target)
+                .from_select(columns, select(*[moved.c[name] for name in columns]))
+                .returning(target.book_uid, target.rating)
+            )
+            result = await session.execute(statement)
+            rows = result.all()
+
+            ratings_by_book = {}
+            for book_uid, rating in rows:
+                if book_uid is not None:
+                    ratings_by_book.setdefault(book_uid, []).append(rating)
+            stats = [
+                await self.apply_rating_changes(book_uid, ratings_by_book[book_uid], session, removed=removed)
+                for book_uid in sorted(ratings_by_book, key=str)
+            ]
+            await session.commit()
+            await invalidate_book_detail(*ratings_by_book)
+            await update_leaderboards(*stats)
+
+            count += len(rows)
+            book_uids.update(ratings_by_book)
+            if len(rows) < chunk_size:
+                break
+        return {"count": count, "book_uids": list(book_uids)}
+
     async def delete_review_to_from_book(
-        self, review_uid: str, user_email: str, session: AsyncSession
+        self, review_uid: str, user_uid, session: AsyncSession
     ):
-        user = await user_service.get_user_by_email(user_email, session)
-
         review = await self.get_review(review_uid, session)
 
-        if not review or (review.user != user):
+        if not review or (review.user_uid != user_uid):
             raise HTTPException(
                 detail="Cannot delete this review",
                 status_code=status.HTTP_403_FORBIDDEN,
             )
 
-        session.delete(review)
+        await session.delete(review)
+
+        stats = await self.apply_rating_changes(review.book_uid, [review.rating], session, removed=True)
+
+        await session.commit()
 
-        await session.commit()
\ No newline at end of file
+        await invalidate_book_detail(review.book_uid)
+        await update_leaderboards(stats)
\ No newline at end of file
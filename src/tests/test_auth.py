@@ -1,4 +1,24 @@
-from src.auth.schemas import UserCreateModel
+from src.auth.schemas import UserCreateModel, Principal
+from src.auth.service import UserService
+from src.auth import service as auth_service_module
+from sqlalchemy.dialects import postgresql
+from src.auth.dependencies import RoleChecker, AccessTokenBearer
+from src.auth import dependencies as auth_dependencies
+from src.errors import InvalidToken, RateLimitExceeded
+from fastapi import Request
+import pytest
+from src.auth import cache as auth_cache
+from src.auth import utils as auth_utils
+from src.db import redis as redis_module
+from src import ratelimit, app
+from fastapi.testclient import TestClient
+from src.auth.utils import create_access_token, decode_token
+from unittest.mock import AsyncMock, MagicMock, Mock
+import asyncio
+import ipaddress
+import threading
+import uuid
+from redis.exceptions import RedisError
 
 auth_prefix = f"/api/v1/auth"
 
@@ -21,4 +41,309 @@ def test_user_creation(fake_session, fake_user_service, test_client):
     assert fake_user_service.user_exists_called_once()
     assert fake_user_service.user_exists_called_once_with(signup_data['email'],fake_session)
     assert fake_user_service.create_user_called_once()
-    assert fake_user_service.create_user_called_once_with(user_data,fake_session)
\ No newline at end of file
+    assert fake_user_service.create_user_called_once_with(user_data,fake_session)
+
+def test_principal_is_served_from_the_cache_without_a_query(monkeypatch):
+    monkeypatch.setattr(auth_cache.redis_client, "get", AsyncMock(return_value=None))
+    monkeypatch.setattr(auth_cache.redis_client, "set", AsyncMock())
+    auth_cache.local_principals.clear()
+    user_uid = uuid.uuid4()
+    row = Mock(_mapping={"uid": user_uid, "email": "a@b.com", "role": "user", "is_verified": True})
+    session = AsyncMock()
+    session.exec.return_value = Mock(first=Mock(return_value=row))
+
+    first = asyncio.run(UserService().get_principal(user_uid, session))
+    second = asyncio.run(UserService().get_principal(user_uid, session))
+
+    assert first == second == Principal(uid=user_uid, email="a@b.com", role="user", is_verified=True)
+    assert session.exec.await_count == 1
+    assert "books" not in str(session.exec.call_args[0][0])
+    assert RoleChecker(["user", "admin"])(second) is True
+
+
+def test_role_change_drops_the_cached_principal(monkeypatch):
+    monkeypatch.setattr(auth_cache.redis_client, "delete", AsyncMock())
+    user_uid = uuid.uuid4()
+    auth_cache.local_principals.set(str(user_uid), Principal(uid=user_uid, email="a@b.com", role="user", is_verified=True))
+    session = AsyncMock()
+    session.execute.return_value = Mock(first=Mock(return_value=(user_uid,)))
+
+    assert asyncio.run(UserService().update_role(user_uid, "admin", session))
+    assert str(user_uid) not in auth_cache.local_principals
+    auth_cache.redis_client.delete.assert_awaited_once_with(auth_cache.principal_key(user_uid))
+
+
+def test_verified_tokens_are_decoded_once(monkeypatch):
+    auth_utils.verified_tokens.clear()
+    token = create_access_token(user_data={"email": "a@b.com", "user_uid": str(uuid.uuid4())})
+    jwt_decode = Mock(wraps=auth_utils.jwt.decode)
+    monkeypatch.setattr(auth_utils.jwt, "decode", jwt_decode)
+
+    first = decode_token(token)
+    second = decode_token(token)
+
+    assert first == second and first["user"]["email"] == "a@b.com"
+    assert jwt_decode.call_count == 1
+    assert decode_token(token[:-2] + "xx") is None
+    assert len(auth_utils.verified_tokens) == 1
+
+
+def test_blocklist_is_answered_locally_while_in_sync(monkeypatch):
+    monkeypatch.setattr(redis_module.redis_client, "get", AsyncMock(return_value=None))
+    monkeypatch.setattr(redis_module, "revocations_in_sync", True)
+    revoked, active = str(uuid.uuid4()), str(uuid.uuid4())
+    redis_module.remember_revoked_jti(revoked)
+
+    assert asyncio.run(redis_module.token_in_blocklist(revoked))
+    assert not asyncio.run(redis_module.token_in_blocklist(active))
+    redis_module.redis_client.get.assert_not_awaited()
+
+    monkeypatch.setattr(redis_module, "revocations_in_sync", False)
+    assert not asyncio.run(redis_module.token_in_blocklist(active))
+    redis_module.redis_client.get.assert_awaited_once_with(redis_module.blocklist_key(active))
+
+
+def test_expired_revocations_are_pruned(monkeypatch):
+    monkeypatch.setattr(redis_module, "revoked_jtis", {})
+    monkeypatch.setattr(redis_module, "revocation_expiries", [])
+    now = [1000.0]
+    monkeypatch.setattr(redis_module.time, "monotonic", lambda: now[0])
+    redis_module.remember_revoked_jti("short", ttl=10)
+    redis_module.remember_revoked_jti("reloaded", ttl=10)
+    #loaded again after a reconnect, with the remaining ttl from redis
+    redis_module.remember_revoked_jti("reloaded", ttl=60)
+
+    now[0] += 30
+    redis_module.remember_revoked_jti("new")
+
+    assert set(redis_module.revoked_jtis) == {"reloaded", "new"}
+    assert len(redis_module.revocation_expiries) == 2
+
+
+def test_every_route_shares_one_access_token_bearer():
+    def bearers(dependant):
+        found = {id(dependant.call)} if isinstance(dependant.call, AccessTokenBearer) else set()
+        for sub_dependant in dependant.dependencies:
+            found |= bearers(sub_dependant)
+        return found
+
+    #FastAPI caches a dependency per callable, a second instance would decode and check every token twice
+    found = set()
+    for route in app.routes:
+        if hasattr(route, "dependant"):
+            found |= bearers(route.dependant)
+    assert found == {id(auth_dependencies.access_token_bearer)}
+
+
+def test_every_token_gets_its_own_jti():
+    user_data = {"email": "a@b.com", "user_uid": str(uuid.uuid4())}
+    first = decode_token(create_access_token(user_data=user_data))
+    second = decode_token(create_access_token(user_data=user_data))
+
+    assert first["jti"] != second["jti"]
+    assert uuid.UUID(first["jti"])
+
+
+def test_tokens_of_an_older_generation_are_rejected(monkeypatch):
+    monkeypatch.setattr(auth_dependencies, "token_in_blocklist", AsyncMock(return_value=False))
+    monkeypatch.setattr(auth_dependencies, "get_token_generation", AsyncMock(return_value=1))
+    user_data = {"email": "a@b.com", "user_uid": str(uuid.uuid4())}
+
+    def request_with(token):
+        return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+    current = create_access_token(user_data=user_data, generation=1)
+    revoked = create_access_token(user_data=user_data, generation=0)
+
+    assert asyncio.run(AccessTokenBearer()(request_with(current)))["gen"] == 1
+    with pytest.raises(InvalidToken):
+        asyncio.run(AccessTokenBearer()(request_with(revoked)))
+
+
+def test_password_checks_run_on_the_password_pool(monkeypatch):
+    threads = []
+    monkeypatch.setattr(auth_utils.password_context, "verify", lambda password, hash: threads.append(threading.current_thread().name) or True)
+
+    assert asyncio.run(auth_utils.verify_password("secret", "hash"))
+    assert threads[0].startswith("password-hash")
+
+
+def test_hashes_with_another_cost_need_a_rehash():
+    cheap_hash = auth_utils.password_context.handler("bcrypt").using(rounds=4).hash("secret")
+    current_hash = asyncio.run(auth_utils.generate_password_hash("secret"))
+
+    assert auth_utils.password_needs_rehash(cheap_hash)
+    assert not auth_utils.password_needs_rehash(current_hash)
+
+
+def test_signup_race_is_caught_by_insert_on_conflict_do_nothing(monkeypatch):
+    monkeypatch.setattr(auth_service_module, "generate_password_hash", AsyncMock(return_value="hash"))
+    session = AsyncMock()
+    #the email was free when checked, another signup took it before the insert
+    session.exec.return_value = Mock(first=Mock(return_value=None))
+    session.execute.return_value = Mock(mappings=Mock(return_value=Mock(first=Mock(return_value=None))))
+    user_data = UserCreateModel(username="jod35", email="Jod@Example.com", first_name="j", last_name="s", password="test123")
+
+    assert asyncio.run(UserService().create_user(user_data, session)) is None
+    statement = session.execute.call_args[0][0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (lower(email)) DO NOTHING RETURNING" in str(statement)
+    assert "password_hash" not in str(statement).split("RETURNING")[1]
+    assert session.execute.await_count == 1
+    assert session.commit.await_count == 0
+
+
+def test_signup_with_a_taken_email_hashes_no_password(monkeypatch):
+    generate_password_hash = AsyncMock(return_value="hash")
+    monkeypatch.setattr(auth_service_module, "generate_password_hash", generate_password_hash)
+    session = AsyncMock()
+    session.exec.return_value = Mock(first=Mock(return_value=uuid.uuid4()))
+    user_data = UserCreateModel(username="jod35", email="JOD@example.com", first_name="j", last_name="s", password="test123")
+
+    assert asyncio.run(UserService().create_user(user_data, session)) is None
+    generate_password_hash.assert_not_awaited()
+    session.execute.assert_not_awaited()
+    lookup = session.exec.call_args[0][0].compile(dialect=postgresql.dialect())
+    assert "SELECT users.uid" in str(lookup) and "WHERE lower(users.email) =" in str(lookup)
+    assert "jod@example.com" in lookup.params.values()
+
+
+def test_login_over_its_rate_limit_gets_429_with_headers(monkeypatch):
+    #TrustedHostMiddleware only lets localhost through
+    test_client = TestClient(app, base_url="http://localhost")
+    token_bucket = AsyncMock(return_value=[0, "0.5"])
+    monkeypatch.setattr(ratelimit, "token_bucket", token_bucket)
+    ratelimit.local_blocks.clear()
+
+    response = test_client.post(f"{auth_prefix}/login", json={"email": "a@b.com", "password": "secret"})
+    again = test_client.post(f"{auth_prefix}/login", json={"email": "a@b.com", "password": "secret"})
+
+    assert response.status_code == again.status_code == 429
+    assert response.headers["RateLimit-Limit"] == "10"
+    assert response.headers["RateLimit-Remaining"] == "0"
+    assert response.headers["Retry-After"] == "3"
+    #the second request was rejected by the local pre-check
+    assert token_bucket.await_count == 1
+    ratelimit.local_blocks.clear()
+
+
+def test_rate_limiter_does_not_log_invalid_tokens(caplog):
+    request = Mock(method="GET", scope={}, url=Mock(path="/books"), client=Mock(host="127.0.0.1"),
+                   headers={"authorization": "Bearer not-a-jwt"})
+
+    keys = asyncio.run(ratelimit.RateLimiter("10/minute").bucket_keys(request))
+
+    assert keys == ["ratelimit:GET:/books:ip:127.0.0.1"]
+    assert not caplog.records
+
+
+def test_one_email_is_limited_across_client_ips(monkeypatch):
+    buckets = {}
+
+    async def token_bucket(keys, args):
+        #the lua script without refill: a request needs a token in every bucket
+        levels = [buckets.get(key, args[0]) for key in keys]
+        allowed = all(level >= 1 for level in levels)
+        for key, level in zip(keys, levels):
+            buckets[key] = level - 1 if allowed else level
+        return [int(allowed), str(min(buckets[key] for key in keys))]
+
+    monkeypatch.setattr(ratelimit, "token_bucket", token_bucket)
+    ratelimit.local_blocks.clear()
+    limiter = ratelimit.RateLimiter("3/minute", key=ratelimit.submitted_email)
+
+    def login(ip, email):
+        return Mock(method="POST", scope={}, url=Mock(path="/api/v1/auth/login"), client=Mock(host=ip),
+                    headers={}, state=Mock(), json=AsyncMock(return_value={"email": email, "password": "guess"}))
+
+    for ip in ("198.51.100.1", "198.51.100.2", "198.51.100.3"):
+        asyncio.run(limiter(login(ip, "Victim@Example.com")))
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter(login("198.51.100.4", "victim@example.com ")))
+    #other accounts from those ips are not affected
+    asyncio.run(limiter(login("198.51.100.1", "someone@example.com")))
+    assert buckets["ratelimit:POST:/api/v1/auth/login:email:victim@example.com"] == 0
+    ratelimit.local_blocks.clear()
+
+
+def test_login_and_reset_requests_are_bucketed_by_email(monkeypatch):
+    test_client = TestClient(app, base_url="http://localhost")
+    token_bucket = AsyncMock(return_value=[0, "0"])
+    monkeypatch.setattr(ratelimit, "token_bucket", token_bucket)
+    ratelimit.local_blocks.clear()
+
+    test_client.post(f"{auth_prefix}/login", json={"email": "A@b.com", "password": "secret"})
+    test_client.post(f"{auth_prefix}/password-reset-request", json={"email": "A@b.com"})
+
+    login_keys, reset_keys = [call.kwargs["keys"] for call in token_bucket.await_args_list]
+    assert login_keys[-1].endswith(":email:a@b.com")
+    assert reset_keys[-1].endswith(":email:a@b.com")
+    ratelimit.local_blocks.clear()
+
+
+def test_password_reset_request_and_confirm_share_a_bucket(monkeypatch):
+    test_client = TestClient(app, base_url="http://localhost")
+    token_bucket = AsyncMock(return_value=[0, "0"])
+    monkeypatch.setattr(ratelimit, "token_bucket", token_bucket)
+    ratelimit.local_blocks.clear()
+
+    test_client.post(f"{auth_prefix}/password-reset-request", json={"email": "a@b.com"})
+    test_client.post(f"{auth_prefix}/password-reset-confirm/token",
+                     json={"new_password": "secret", "confirm_new_password": "secret"})
+
+    request_keys, confirm_keys = [call.kwargs["keys"] for call in token_bucket.await_args_list]
+    assert request_keys[0] == confirm_keys[0] == "ratelimit:password-reset:ip:testclient"
+    ratelimit.local_blocks.clear()
+
+
+def test_rate_limits_are_validated():
+    assert ratelimit.parse_rate("10/minute") == (10, 60)
+    with pytest.raises(ValueError):
+        ratelimit.parse_rate("10 per minute")
+
+
+def test_ip_bucket_uses_forwarded_address_only_behind_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(ratelimit, "trusted_proxies", [ipaddress.ip_network("10.0.0.0/8")])
+
+    def request(peer, forwarded=None):
+        headers = {"x-forwarded-for": forwarded} if forwarded else {}
+        return Mock(client=Mock(host=peer), headers=headers)
+
+    #the left-most entry is whatever the client sent
+    assert ratelimit.client_ip(request("10.0.0.2", "6.6.6.6, 203.0.113.7, 10.0.0.1")) == "203.0.113.7"
+    assert ratelimit.client_ip(request("203.0.113.9", "6.6.6.6")) == "203.0.113.9"
+    assert ratelimit.client_ip(request("10.0.0.2")) == "10.0.0.2"
+
+
+def test_revoked_tokens_stay_rejected_when_redis_can_not_store_the_generation(monkeypatch):
+    user_uid = str(uuid.uuid4())
+    generations = {user_uid: b"0"}
+
+    async def hdel(key, field):
+        generations.pop(field, None)
+
+    async def hget(key, field):
+        return generations.get(field)
+
+    monkeypatch.setattr(auth_cache.redis_client, "hset", AsyncMock(side_effect=RedisError("read only replica")))
+    monkeypatch.setattr(auth_cache.redis_client, "hdel", hdel)
+    monkeypatch.setattr(auth_cache.redis_client, "hget", hget)
+    monkeypatch.setattr(auth_cache.redis_client, "hsetnx", AsyncMock())
+    monkeypatch.setattr(auth_dependencies, "token_in_blocklist", AsyncMock(return_value=False))
+    #postgres already has the bumped generation
+    db_session = AsyncMock()
+    db_session.exec.return_value = Mock(first=Mock(return_value=1))
+    session_maker = MagicMock()
+    session_maker.return_value.__aenter__.return_value = db_session
+    monkeypatch.setattr(auth_cache, "async_session_maker", session_maker)
+    session = AsyncMock()
+    session.execute.return_value = Mock(scalar_one_or_none=Mock(return_value=1))
+    old_token = create_access_token(user_data={"email": "a@b.com", "user_uid": user_uid}, generation=0)
+
+    assert asyncio.run(UserService().revoke_all_tokens(user_uid, session))
+    #another worker, nothing in its local cache
+    auth_cache.local_token_generations.clear()
+
+    request = Request({"type": "http", "headers": [(b"authorization", f"Bearer {old_token}".encode())]})
+    with pytest.raises(InvalidToken):
+        asyncio.run(AccessTokenBearer()(request))
+    assert user_uid not in generations
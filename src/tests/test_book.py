@@ -1,4 +1,24 @@
-from src.books.schemas import BookCreateModel
+from src.books.schemas import BookCreateModel, BookUpdateModel, Book, BookBatchModel
+from src.books.routes import parse_bulk_body, parse_uids, book_validators
+from src.conditional import is_not_modified, validator_headers, http_date
+from src.books import cache as book_cache
+from src.books import routes as book_routes
+from src.auth.dependencies import access_token_bearer
+from src import app
+from fastapi.testclient import TestClient
+from src.books import service as book_service_module
+from src.books.service import BookService, EXPORT_COLUMNS, books_to_ndjson, books_to_csv
+from src.db.pagination import encode_cursor, decode_cursor
+from src.errors import InvalidCursor, InvalidFieldSelection
+from src.fields import parse_fields, project
+from datetime import datetime
+from sqlalchemy.dialects import postgresql
+from unittest.mock import AsyncMock, Mock
+import asyncio
+import pytest
+import json
+import uuid
+import time
 
 books_prefix = f"/api/v1/books"
 
@@ -42,4 +62,236 @@ def test_update_book_by_uid(test_client, fake_book_service,test_book, fake_sessi
     response = test_client.put(f"{books_prefix}/{test_book.uid}")
 
     assert fake_book_service.get_book_called_once()
-    assert fake_book_service.get_book_called_once_with(test_book.uid,fake_session)
\ No newline at end of file
+    assert fake_book_service.get_book_called_once_with(test_book.uid,fake_session)
+
+def test_book_page_cursor_round_trip(test_book):
+    cursor = encode_cursor(test_book.update_at, test_book.uid)
+
+    assert decode_cursor(cursor, datetime.fromisoformat, uuid.UUID) == (test_book.update_at, test_book.uid)
+
+
+def test_invalid_book_page_cursor():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor", datetime.fromisoformat, uuid.UUID)
+
+
+def test_export_encoders(test_book):
+    row = {column: getattr(test_book, column) for column in EXPORT_COLUMNS}
+
+    ndjson_lines = books_to_ndjson([row, row]).splitlines()
+    csv_lines = books_to_csv([row]).decode().splitlines()
+
+    assert len(ndjson_lines) == 2
+    assert json.loads(ndjson_lines[0])["uid"] == str(test_book.uid)
+    assert csv_lines[0].split(",")[0] == str(test_book.uid)
+
+
+def test_parse_ndjson_bulk_body():
+    body = b'{"title": "a"}\n\nnot json\n{"title": "b"}\n'
+
+    items = parse_bulk_body(body, "application/x-ndjson")
+
+    assert items == [{"title": "a"}, "not json", {"title": "b"}]
+
+
+def test_bulk_create_reports_invalid_rows():
+    session = AsyncMock()
+    session.execute.return_value.scalars = Mock(return_value=Mock(all=Mock(return_value=[uuid.uuid4()])))
+    valid_book = {
+        "title":"Test Title",
+        "author" : "Test Author",
+        "publisher": "Test Publications",
+        "published_date":"2024-12-10",
+        "language": "English",
+        "page_count": 215
+    }
+
+    result = asyncio.run(BookService().create_books_bulk([{"title": "missing columns"}, valid_book], None, session))
+
+    assert session.execute.await_count == 1
+    assert result["inserted"] == 1
+    assert [error["index"] for error in result["errors"]] == [0]
+
+
+def test_search_books_pages_by_rank(test_book):
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=[(test_book, 0.75), (test_book, 0.5)]))
+
+    page = asyncio.run(BookService().search_books("sample", session, limit=1))
+
+    assert page["items"][0]["rank"] == 0.75
+    assert decode_cursor(page["next_cursor"], float, uuid.UUID) == (0.75, test_book.uid)
+
+
+def test_suggestions_are_served_from_cache():
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=[(uuid.uuid4(), "The Hobbit", "J. R. R. Tolkien")]))
+    book_service = BookService()
+
+    first = asyncio.run(book_service.suggest_books("Hobb", session))
+    second = asyncio.run(book_service.suggest_books(" hobb ", session))
+
+    assert session.exec.await_count == 1
+    assert first == second
+
+
+def test_short_suggest_prefixes_use_a_title_range_not_trigrams():
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=[]))
+
+    asyncio.run(BookService().suggest_books("Tq", session))
+
+    compiled = session.exec.call_args[0][0].compile(dialect=postgresql.dialect())
+    sql = " ".join(str(compiled).split())
+    assert '(lower(books.title) COLLATE "C") >=' in sql and '(lower(books.title) COLLATE "C") <' in sql
+    assert 'ORDER BY lower(books.title) COLLATE "C" LIMIT' in sql
+    assert "%>" not in sql and "word_similarity" not in sql
+    assert {"tq", "tr"} <= set(compiled.params.values())
+
+
+def test_book_detail_cache_counts_hits_and_misses(monkeypatch, test_book):
+    fake_redis = AsyncMock()
+    fake_redis.hgetall.side_effect = [{}, {b"body": b'{"uid": "cached"}', b"etag": b'"v1"', b"last_modified": b""}]
+    monkeypatch.setattr(book_cache, "redis_client", fake_redis)
+    hits = book_cache.book_detail_cache_hits._value.get()
+    misses = book_cache.book_detail_cache_misses._value.get()
+
+    assert asyncio.run(book_cache.get_cached_book_detail(test_book.uid)) is None
+    cached = asyncio.run(book_cache.get_cached_book_detail(test_book.uid))
+    assert cached == {"body": b'{"uid": "cached"}', "etag": '"v1"', "last_modified": None}
+    assert book_cache.book_detail_cache_hits._value.get() == hits + 1
+    assert book_cache.book_detail_cache_misses._value.get() == misses + 1
+    fake_redis.hgetall.assert_awaited_with(book_cache.book_detail_key(test_book.uid))
+
+
+def test_book_detail_key_is_the_same_for_every_spelling_of_a_uid():
+    uid = uuid.uuid4()
+    assert book_cache.book_detail_key(uid) == book_cache.book_detail_key(str(uid).upper())
+    assert book_cache.book_detail_key(uid) == book_cache.book_detail_key(uid.hex)
+
+
+def test_conditional_get_validators(test_book):
+    etag, last_modified = book_validators(test_book)
+    headers = validator_headers(etag, last_modified)
+
+    assert etag == book_validators(test_book)[0]
+    assert is_not_modified(Mock(headers={"if-none-match": f'W/"other", {etag}'}), etag, last_modified)
+    assert not is_not_modified(Mock(headers={"if-none-match": '"other"'}), etag, last_modified)
+    assert is_not_modified(Mock(headers={"if-modified-since": headers["Last-Modified"]}), etag, last_modified)
+
+
+def test_http_dates_convert_naive_local_times_to_gmt(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Istanbul")
+    time.tzset()
+    try:
+        #Istanbul is UTC+3 all year
+        local_noon = datetime(2024, 1, 15, 12, 0, 0)
+        assert http_date(local_noon) == "Mon, 15 Jan 2024 09:00:00 GMT"
+        since = Mock(headers={"if-modified-since": "Mon, 15 Jan 2024 09:00:00 GMT"})
+        assert is_not_modified(since, '"etag"', local_noon)
+        assert not is_not_modified(since, '"etag"', datetime(2024, 1, 15, 12, 0, 1))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_average_rating_is_computed_from_aggregates(test_book):
+    test_book.review_count = 4
+    test_book.rating_sum = 15
+    test_book.author = "sample author"
+    test_book.publisher = "sample publisher"
+    test_book.published_date = test_book.update_at.date()
+    test_book.created_at = test_book.update_at
+
+    book = Book.model_validate(test_book, from_attributes=True)
+
+    assert book.average_rating == 3.75
+    assert "rating_sum" not in book.model_dump()
+
+
+def test_sparse_fieldset_projection(test_book):
+    fields = parse_fields("uid, title,uid", Book)
+    row = Mock(_mapping={"uid": test_book.uid, "title": "sample title", "created_at": datetime.now()})
+
+    assert fields == ("uid", "title")
+    assert project(Book, fields, [row]) == [{"uid": str(test_book.uid), "title": "sample title"}]
+
+
+def test_sparse_fieldset_rejects_hidden_fields():
+    with pytest.raises(InvalidFieldSelection):
+        parse_fields("uid,rating_sum", Book)
+
+
+def test_update_book_is_one_round_trip(monkeypatch, test_book):
+    monkeypatch.setattr(book_service_module, "invalidate_book_detail", AsyncMock())
+    session = AsyncMock()
+    session.execute.return_value = Mock(mappings=Mock(return_value=Mock(first=Mock(return_value={"uid": test_book.uid}))))
+
+    updated = asyncio.run(BookService().update_book(test_book.uid, BookUpdateModel(title="New Title"), session))
+
+    assert updated == {"uid": test_book.uid}
+    assert session.execute.await_count == 1
+    assert session.exec.await_count == 0
+    assert session.refresh.await_count == 0
+    statement = str(session.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+    assert statement.startswith("UPDATE books SET") and "RETURNING" in statement
+
+
+def test_delete_missing_book_is_one_round_trip(monkeypatch, test_book):
+    monkeypatch.setattr(book_service_module, "invalidate_book_detail", AsyncMock())
+    session = AsyncMock()
+    session.execute.return_value = Mock(first=Mock(return_value=None))
+
+    deleted = asyncio.run(BookService().delete_book(test_book.uid, session))
+
+    assert deleted is None
+    assert session.execute.await_count == 1
+    assert session.exec.await_count == 0
+    assert session.commit.await_count == 0
+
+
+def test_batch_lookup_keeps_request_order(test_book):
+    other_book = Mock(uid=uuid.uuid4())
+    missing_uid = uuid.uuid4()
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=[test_book, other_book]))
+
+    batch = asyncio.run(BookService().get_books_by_uids([other_book.uid, missing_uid, test_book.uid], session))
+
+    assert session.exec.await_count == 1
+    assert batch["items"] == [other_book, test_book]
+    assert batch["missing"] == [missing_uid]
+
+
+def test_batch_lookup_has_its_own_route_and_response_schema(monkeypatch, test_book):
+    openapi = app.openapi()
+    batch_schema = openapi["paths"]["/api/v1/books/batch"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    refs = {option["$ref"].rsplit("/", 1)[-1] for option in batch_schema["anyOf"]}
+    assert refs == {"BookBatchModel", "BookDetailBatchModel"}
+    page_params = {param["name"] for param in openapi["paths"]["/api/v1/books/"]["get"]["parameters"]}
+    assert "uids" not in page_params
+
+    test_book.author, test_book.publisher, test_book.created_at = "author", "publisher", datetime.now()
+    test_book.published_date = datetime.now().date()
+    missing_uid = uuid.uuid4()
+    monkeypatch.setattr(book_routes.book_service, "get_books_by_uids",
+                        AsyncMock(return_value={"items": [test_book], "missing": [missing_uid]}))
+    app.dependency_overrides[book_routes.role_checker] = lambda: True
+    app.dependency_overrides[access_token_bearer] = lambda: {}
+    try:
+        response = TestClient(app, base_url="http://localhost").get(
+            "/api/v1/books/batch", params={"uids": f"{test_book.uid},{missing_uid}"}
+        )
+    finally:
+        del app.dependency_overrides[book_routes.role_checker]
+        del app.dependency_overrides[access_token_bearer]
+    assert response.status_code == 200
+    body = BookBatchModel.model_validate(response.json())
+    assert [book.uid for book in body.items] == [test_book.uid]
+    assert body.missing == [missing_uid]
+
+
+def test_parse_batch_uids(test_book):
+    uids = parse_uids([f"{test_book.uid}, {test_book.uid}"])
+
+    assert uids == [test_book.uid]
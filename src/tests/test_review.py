@@ -0,0 +1,214 @@
+from src.reviews.service import ReviewService
+from src.reviews import service as review_service_module
+from src.books import leaderboards as leaderboards_module
+from src.books import trending as trending_module
+from src.reviews import ingest as ingest_module
+from src.config import Config
+from src.reviews.schemas import ReviewCreateModel, ReviewModel, ReviewModerationFilter
+from sqlalchemy.dialects import postgresql
+from src.db.pagination import encode_cursor, decode_cursor
+from src.errors import InvalidCursor, BookNotFound
+from pydantic import ValidationError
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, Mock
+import asyncio
+import pytest
+import uuid
+
+reviews_prefix = f"/api/v1/reviews"
+
+
+def test_review_rating_must_be_between_one_and_five():
+    with pytest.raises(ValidationError):
+        ReviewCreateModel(rating=6, review_text="too good")
+
+
+def test_rating_changes_are_one_relative_update():
+    session = AsyncMock()
+    session.execute.return_value = Mock()
+
+    asyncio.run(ReviewService().apply_rating_changes(uuid.uuid4(), [5, 5, 3], session, removed=True))
+
+    assert session.execute.await_count == 1
+    params = session.execute.call_args[0][0].compile(dialect=postgresql.dialect()).params
+    assert params["review_count_1"] == -3
+    assert params["rating_sum_1"] == -13
+
+
+def test_book_reviews_page_by_rating():
+    reviews = [Mock(rating=5 - i, created_at=datetime.now(), uid=uuid.uuid4()) for i in range(3)]
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=reviews))
+
+    page = asyncio.run(ReviewService().get_book_reviews(uuid.uuid4(), session, limit=2, sort="rating"))
+
+    assert page["items"] == reviews[:2]
+    cursor = decode_cursor(page["next_cursor"], int, datetime.fromisoformat, uuid.UUID)
+    assert cursor == (reviews[1].rating, reviews[1].created_at, reviews[1].uid)
+
+
+def test_newest_cursor_is_rejected_by_rating_sort():
+    cursor = encode_cursor(datetime.now(), uuid.uuid4())
+
+    with pytest.raises(InvalidCursor):
+        asyncio.run(ReviewService().get_book_reviews(uuid.uuid4(), AsyncMock(), cursor=cursor, sort="rating"))
+
+
+def test_first_review_pages_are_limited_per_book():
+    book_a, book_b = uuid.uuid4(), uuid.uuid4()
+    now = datetime.now()
+    reviews = [Mock(book_uid=book_a, created_at=now, uid=uuid.uuid4()) for _ in range(3)]
+    session = AsyncMock()
+    session.exec.return_value = Mock(all=Mock(return_value=reviews))
+
+    pages = asyncio.run(ReviewService().get_first_review_pages([book_a, book_b], session, limit=2))
+
+    compiled = session.exec.call_args[0][0].compile(dialect=postgresql.dialect())
+    sql = " ".join(str(compiled).split())
+    assert "AS requested(book_uid) JOIN LATERAL" in sql
+    assert "WHERE reviews.book_uid = requested.book_uid ORDER BY reviews.created_at DESC, reviews.uid DESC LIMIT" in sql
+    assert 3 in compiled.params.values()
+    assert pages[book_a]["items"] == reviews[:2] and pages[book_a]["next_cursor"]
+    assert pages[book_b] == {"items": [], "next_cursor": None}
+
+
+def test_add_review_loads_neither_book_nor_user(monkeypatch):
+    monkeypatch.setattr(review_service_module, "invalidate_book_detail", AsyncMock())
+    monkeypatch.setattr(review_service_module, "update_leaderboards", AsyncMock())
+    monkeypatch.setattr(review_service_module, "record_review_activity", AsyncMock())
+    session = AsyncMock()
+    session.add = Mock()
+    session.execute.return_value = Mock(first=Mock(return_value=("book_uid", 1, 4, "English")))
+    review_data = ReviewCreateModel(rating=4, review_text="great")
+
+    review = asyncio.run(ReviewService().add_review_to_book(uuid.uuid4(), review_data, uuid.uuid4(), session))
+
+    assert review.rating == 4
+    assert session.execute.await_count == 1
+    assert session.exec.await_count == 0
+    session.commit.assert_awaited_once()
+
+
+def test_add_review_to_missing_book():
+    session = AsyncMock()
+    session.execute.return_value = Mock(first=Mock(return_value=None))
+
+    with pytest.raises(BookNotFound):
+        asyncio.run(ReviewService().add_review_to_book(
+            uuid.uuid4(), ReviewCreateModel(rating=4, review_text="great"), uuid.uuid4(), session
+        ))
+    assert session.commit.await_count == 0
+
+
+def test_review_batch_is_one_insert_and_one_update_per_book(monkeypatch):
+    monkeypatch.setattr(review_service_module, "invalidate_book_detail", AsyncMock())
+    monkeypatch.setattr(review_service_module, "update_leaderboards", AsyncMock())
+    monkeypatch.setattr(review_service_module, "record_review_activity", AsyncMock())
+    user_uid, book_a, book_b, deleted_book = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    now = datetime.now()
+    reviews = [
+        ReviewModel(uid=uuid.uuid4(), rating=rating, review_text="queued", user_uid=user_uid, book_uid=book_uid,
+                    created_at=now, update_at=now)
+        for rating, book_uid in ((5, book_a), (3, book_a), (4, book_b), (1, deleted_book))
+    ]
+    session = AsyncMock()
+    session.exec.side_effect = [
+        Mock(all=Mock(return_value=[book_a, book_b])),
+        Mock(all=Mock(return_value=[user_uid])),
+    ]
+    session.execute.side_effect = [
+        Mock(all=Mock(return_value=[(book_a, 5), (book_a, 3), (book_b, 4)])),
+        Mock(), Mock(),
+    ]
+
+    touched = asyncio.run(ReviewService().add_reviews_batch(reviews, session))
+
+    assert set(touched) == {book_a, book_b}
+    insert = session.execute.call_args_list[0][0][0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (uid) DO NOTHING" in str(insert)
+    assert deleted_book not in insert.params.values()
+    #the insert plus one aggregate update per book
+    assert session.execute.await_count == 3
+    session.commit.assert_awaited_once()
+
+
+def test_ingest_claims_stale_entries_and_dead_letters_exhausted_ones(monkeypatch):
+    now = datetime.now()
+    poison, good = [
+        (entry_id, ReviewModel(uid=uuid.uuid4(), rating=4, review_text="queued", user_uid=uuid.uuid4(),
+                               book_uid=uuid.uuid4(), created_at=now, update_at=now))
+        for entry_id in (b"1-0", b"2-0")
+    ]
+    read_reviews = AsyncMock(side_effect=[[poison], [good]])
+    dead_letter_reviews = AsyncMock()
+    monkeypatch.setattr(ingest_module, "claim_stale_reviews", AsyncMock(return_value=2))
+    monkeypatch.setattr(ingest_module, "read_reviews", read_reviews)
+    monkeypatch.setattr(ingest_module, "delivery_counts", AsyncMock(
+        side_effect=[{b"1-0": Config.REVIEW_MAX_DELIVERIES + 1}, {b"2-0": 2}]
+    ))
+    monkeypatch.setattr(ingest_module, "dead_letter_reviews", dead_letter_reviews)
+    consumer = ingest_module.ReviewIngestConsumer(name="worker")
+    #a flush failed, the pending entries are retried one at a time
+    consumer._isolating = True
+
+    entries = asyncio.run(consumer.next_batch())
+
+    assert entries == [good]
+    dead_letter_reviews.assert_awaited_once_with([poison])
+    assert all(call.args[1:3] == ("0", 1) for call in read_reviews.await_args_list)
+
+
+def test_leaderboards_take_exact_scores_from_the_aggregates(monkeypatch):
+    pipe = Mock(execute=AsyncMock())
+    pipeline = MagicMock()
+    pipeline.return_value.__aenter__.return_value = pipe
+    monkeypatch.setattr(leaderboards_module.redis_client, "pipeline", pipeline)
+    popular, new = uuid.uuid4(), uuid.uuid4()
+
+    asyncio.run(leaderboards_module.update_leaderboards((popular, 10, 42, "English"), (new, 1, 5, "English")))
+
+    zadds = [call.args for call in pipe.zadd.call_args_list]
+    assert ("leaderboard:rating", {str(popular): 4.2}) in zadds
+    assert ("leaderboard:reviews:English", {str(new): 1}) in zadds
+    #one review is not enough for the top rated board
+    assert ("leaderboard:rating", str(new)) in [call.args for call in pipe.zrem.call_args_list]
+    pipe.execute.assert_awaited_once()
+
+
+def test_trending_merge_decays_older_buckets(monkeypatch):
+    monkeypatch.setattr(trending_module.Config, "TRENDING_WINDOW_HOURS", 48)
+    monkeypatch.setattr(trending_module.Config, "TRENDING_HALF_LIFE_HOURS", 24)
+    client = Mock()
+    now = 1_000 * trending_module.BUCKET_SECONDS
+
+    trending_module.merge_trending_buckets(client, now)
+
+    key, weights = client.zunionstore.call_args[0]
+    assert key == trending_module.TRENDING_KEY
+    assert len(weights) == 48
+    assert weights["trending:bucket:1000"] == 1
+    assert weights["trending:bucket:976"] == 0.5
+
+
+def test_moderation_filter_must_not_be_empty():
+    with pytest.raises(ValidationError):
+        ReviewModerationFilter()
+
+
+def test_bulk_delete_runs_in_chunks(monkeypatch):
+    monkeypatch.setattr(review_service_module, "invalidate_book_detail", AsyncMock())
+    monkeypatch.setattr(review_service_module, "update_leaderboards", AsyncMock())
+    book_uid = uuid.uuid4()
+    session = AsyncMock()
+    session.execute.side_effect = [
+        Mock(all=Mock(return_value=[(book_uid, 1), (book_uid, 2)])), Mock(),
+        Mock(all=Mock(return_value=[(None, 1)])),
+    ]
+
+    result = asyncio.run(ReviewService().delete_reviews(ReviewModerationFilter(user_uid=uuid.uuid4()), session, chunk_size=2))
+
+    assert result == {"count": 3, "book_uids": [book_uid]}
+    statement = str(session.execute.call_args_list[0][0][0].compile(dialect=postgresql.dialect()))
+    assert statement.startswith("WITH moved AS \n(DELETE FROM reviews")
+    assert "INSERT INTO deleted_reviews" in statement
+    assert session.commit.await_count == 2